@@ -1,32 +1,113 @@
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Union
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, timezone
 from uuid import uuid4
+import hashlib
 from enum import Enum
+import csv
+import io
+import json
 
 
-from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi import Body, Depends, FastAPI, HTTPException, Query, Request, Response, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlmodel import Session, select
-from pydantic import BaseModel, EmailStr, Field
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from pydantic import BaseModel, EmailStr, Field, ValidationError
 
 app = FastAPI()
 
-from database import get_session
+import cache
+import crud
+import metrics
+import query_log
+import singleflight
+import timing
+from config import (
+    DATABASE_URL,
+    DATABASE_ASYNC,
+    AUTH_STATELESS,
+    TASK_PAGE_DEFAULT_LIMIT,
+    TASK_PAGE_MAX_LIMIT,
+    TASK_BULK_MAX_ITEMS,
+    TASK_SYNC_OVERLAP_SECONDS,
+    TASK_SYNC_RETENTION_SECONDS,
+    FAST_JSON,
+    REQUEST_COALESCING,
+    TASK_EXPORT_BATCH_SIZE,
+    TASK_IMPORT_BATCH_SIZE,
+    TASK_IMPORT_MAX_REPORTED_ERRORS,
+    TASK_IMPORT_MAX_RECORD_BYTES,
+    COMPRESSION_ENCODINGS,
+    COMPRESSION_MINIMUM_SIZE,
+    COMPRESSION_CONTENT_TYPES,
+    COMPRESSION_GZIP_LEVEL,
+    COMPRESSION_BROTLI_QUALITY,
+    COMPRESSION_ZSTD_LEVEL,
+    METRICS_ENABLED,
+    SERVER_TIMING_SAMPLE_RATE,
+    SERVER_TIMING_DEBUG_HEADER,
+)
+from compression import CompressionMiddleware
+from database import (
+    get_session,
+    get_async_session,
+    get_engine,
+    get_async_engine,
+    dispose_engines,
+    dispose_async_engines,
+    run_in_session,
+    stream_in_session,
+)
+from importer import RecordError, iter_lines, parse_csv, parse_ndjson
 from models import User, Task
-from security import get_password_hash, verify_password
-from auth import create_access_token, verify_token, oauth2_scheme, ACCESS_TOKEN_EXPIRE_MINUTES
+from pagination import encode_cursor, decode_cursor, encode_watermark, decode_watermark
+from serialization import TASK_FIELDS, dumps, json_response, task_encoder, task_fragments, user_encoder
+from security import get_password_hash_async, verify_password_async, shutdown_executor
+from auth import (
+    create_access_token,
+    verify_token,
+    oauth2_scheme,
+    token_claims,
+    token_versions,
+    principal_from_payload,
+    principal_from_user,
+    Principal,
+    ACCESS_TOKEN_EXPIRE_MINUTES,
+)
 
 def create_app() -> FastAPI:
     """
     Creates and configures the FastAPI application.
     """
 
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        query_log.start()
+        metrics.start()
+        # Build the pooled engine once at startup instead of on the first request.
+        if DATABASE_URL:
+            get_async_engine() if DATABASE_ASYNC else get_engine()
+        yield
+        dispose_engines()
+        await dispose_async_engines()
+        shutdown_executor()
+        metrics.stop()
+        query_log.stop()
+
+    # Endpoints take a regular Session (run in the threadpool) or an AsyncSession
+    # (run on the event loop) depending on configuration; see run_in_session.
+    session_dependency = get_async_session if DATABASE_ASYNC else get_session
+    DB = Union[Session, AsyncSession]
 
     app = FastAPI(
         title="AI-Driven Todo App",
         description="A robust backend for a modern todo list application, powered by AI.",
-        version="1.0.0"
+        version="1.0.0",
+        lifespan=lifespan,
     )
 
     # --- Middleware Configuration ---
@@ -37,6 +118,29 @@ def create_app() -> FastAPI:
         allow_methods=["*"],
         allow_headers=["*"],
     )
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=COMPRESSION_MINIMUM_SIZE,
+        content_types=COMPRESSION_CONTENT_TYPES,
+        encodings=COMPRESSION_ENCODINGS,
+        levels={
+            "gzip": COMPRESSION_GZIP_LEVEL,
+            "br": COMPRESSION_BROTLI_QUALITY,
+            "zstd": COMPRESSION_ZSTD_LEVEL,
+        },
+    )
+    if SERVER_TIMING_SAMPLE_RATE > 0 or SERVER_TIMING_DEBUG_HEADER:
+        timing.instrument()
+        # Routes must be declared after this to time their serialization.
+        app.router.route_class = timing.TimedRoute
+        app.add_middleware(
+            timing.ServerTimingMiddleware,
+            sample_rate=SERVER_TIMING_SAMPLE_RATE,
+            debug_header=SERVER_TIMING_DEBUG_HEADER,
+        )
+    if METRICS_ENABLED:
+        # Outermost, so the recorded latency includes the other middleware.
+        app.add_middleware(metrics.MetricsMiddleware)
 
     # --- Pydantic Models ---
     class UserCreate(BaseModel):
@@ -74,122 +178,544 @@ def create_app() -> FastAPI:
         title: Optional[str] = Field(default=None, max_length=200)
         description: Optional[str] = Field(default=None, max_length=1000)
         status: Optional[Status] = Field(default=None)
+        # Only update if the task is still at this version (same as If-Match)
+        version: Optional[int] = Field(default=None)
 
     class TaskRead(BaseModel):
         id: int
         user_id: str
         title: str
         description: Optional[str]
+        status: Status
         completed: bool
         created_at: datetime
         updated_at: datetime
+        version: int
 
         class Config:
             json_encoders = {datetime: lambda v: v.isoformat() if v else None}
 
+    class BulkItemError(BaseModel):
+        index: int
+        errors: List[Dict[str, Any]]
+
+    class BulkTaskResult(BaseModel):
+        created: List[TaskRead]
+        errors: List[BulkItemError] = []
+
+    class BulkTaskUpdate(BaseModel):
+        ids: Optional[List[int]] = Field(default=None, max_length=TASK_BULK_MAX_ITEMS)
+        status_filter: Optional[Status] = None
+        status: Status
+
+    class BulkTaskChange(BaseModel):
+        affected: int
+        ids: List[int]
+
+    class TaskChanges(BaseModel):
+        changed: List[TaskRead]
+        deleted: List[int]
+        watermark: str
+        # More pages of the initial sync follow; pass the watermark back right away
+        has_more: bool = False
+
+    class TaskStats(BaseModel):
+        pending: int
+        in_progress: int
+        completed: int
+        total: int
+
+    class ExportFormat(str, Enum):
+        ndjson = "ndjson"
+        csv = "csv"
+
+    class ImportRowError(BaseModel):
+        line: int
+        errors: List[Dict[str, Any]]
+
+    class ImportSummary(BaseModel):
+        inserted: int
+        rejected: int
+        errors: List[ImportRowError]
+
+    def new_task_values(task_in: TaskCreate, user_id: str, now: Optional[datetime]) -> dict:
+        return dict(
+            title=task_in.title,
+            description=task_in.description,
+            status=task_in.status.value,
+            completed=(task_in.status == Status.completed),
+            user_id=user_id,
+            created_at=now,
+            updated_at=now,
+        )
+
+    # --- Conditional requests ---
+    # The task list ETag comes from the user's collection version (bumped by
+    # every write) and the query; a task's ETag is its row version. Both can
+    # be checked without loading any task.
+    def canonical_query(request: Request) -> str:
+        return "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+
+    def list_etag(user_id: str, version: int, request: Request) -> str:
+        query = canonical_query(request)
+        digest = hashlib.sha1(f"{user_id}?{query}".encode()).hexdigest()[:12]
+        return f'W/"{version}-{digest}"'
+
+    def task_etag(task_id: int, version: int) -> str:
+        return f'"{task_id}.{version}"'
+
+    def etag_matches(header: Optional[str], etag: str) -> bool:
+        if not header:
+            return False
+        if header.strip() == "*":
+            return True
+        # Weak comparison, as If-None-Match requires
+        candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+        return etag.removeprefix("W/") in candidates
+
+    def if_match_version(header: Optional[str], task_id: int) -> Optional[int]:
+        """
+        Returns the task version an If-Match header asks for, None for no
+        condition, or -1 for a tag that cannot match.
+        """
+        if not header or header.strip() == "*":
+            return None
+        for tag in header.split(","):
+            tag = tag.strip()
+            if tag.startswith('"') and tag.endswith('"'):
+                tag_id, _, tag_version = tag[1:-1].partition(".")
+                if tag_id == str(task_id) and tag_version.isdigit():
+                    return int(tag_version)
+        return -1
+
+    def not_modified(etag: str) -> Response:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    async def invalidate_task_lists(user_id: str) -> None:
+        # Cached lists are keyed by the collection version, which every write
+        # bumps, so this only frees entries that can no longer be hit.
+        if cache.task_lists is not None:
+            await cache.task_lists.invalidate(user_id)
+
     # --- API Endpoints ---
     @app.get("/")
     def read_root():
         return {"message": "Welcome to the AI-Driven Todo App Backend!"}
 
+    if METRICS_ENABLED:
+        @app.get("/metrics", include_in_schema=False)
+        def read_metrics():
+            return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
     @app.post("/api/register", response_model=Token, status_code=status.HTTP_201_CREATED)
-    def register_user(user_in: UserCreate, db: Session = Depends(get_session)):
-        if db.exec(select(User).where(User.email == user_in.email)).first():
+    async def register_user(user_in: UserCreate, db: DB = Depends(session_dependency)):
+        if await run_in_session(db, crud.get_user_by_email, user_in.email):
             raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Email already registered")
 
         db_user = User(
             id=str(uuid4()),
             email=user_in.email,
-            hashed_password=get_password_hash(user_in.password),
+            hashed_password=await get_password_hash_async(user_in.password),
             created_at=datetime.now(timezone.utc)
         )
-        db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
+        db_user = await run_in_session(db, crud.create_user, db_user)
 
-        access_token = create_access_token(data={"sub": db_user.id})
+        access_token = create_access_token(data=token_claims(db_user))
         return {"access_token": access_token, "token_type": "bearer"}
 
     @app.post("/api/login", response_model=Token)
-    def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_session)):
-        user = db.exec(select(User).where(User.email == form_data.username)).first()
-        if not user or not verify_password(form_data.password, user.hashed_password):
+    async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: DB = Depends(session_dependency)):
+        user = await run_in_session(db, crud.get_user_by_email, form_data.username)
+        if not user or not await verify_password_async(form_data.password, user.hashed_password):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Incorrect username or password",
                 headers={"WWW-Authenticate": "Bearer"},
             )
 
-        access_token = create_access_token(data={"sub": user.id})
+        access_token = create_access_token(data=token_claims(user))
         return {"access_token": access_token, "token_type": "bearer"}
 
-    def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_session)) -> User:
-        payload = verify_token(token)
+    def load_principal(db: Session, user_id: str) -> Optional[Principal]:
+        user = crud.get_user(db, user_id)
+        return principal_from_user(user) if user is not None else None
+
+    async def load_for_user(name: str, user_id: str, db: DB, fn):
+        # fn must return plain values: with coalescing, concurrent requests
+        # share the result, so it must not be bound to the leader's session.
+        if REQUEST_COALESCING:
+            return await singleflight.reads.run((name, user_id), run_in_session, db, fn, user_id)
+        return await run_in_session(db, fn, user_id)
+
+    credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials")
+
+    async def get_current_user(token: str = Depends(oauth2_scheme), db: DB = Depends(session_dependency)) -> Principal:
+        with timing.phase("auth"):
+            payload = verify_token(token)
         user_id = payload.get("sub")
-        if not user_id or (user := db.exec(select(User).where(User.id == user_id)).first()) is None:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials")
+        if not user_id:
+            raise credentials_exception
+
+        if AUTH_STATELESS and (principal := principal_from_payload(payload)) is not None:
+            # The token carries everything handlers need; only the (cached)
+            # token version is checked, so revoked tokens are still rejected.
+            current_version = token_versions.get(user_id)
+            if current_version is None:
+                with timing.phase("user"):
+                    current_version = await load_for_user("token_version", user_id, db, crud.get_token_version)
+                if current_version is None:
+                    raise credentials_exception
+                token_versions.set(user_id, current_version)
+            if principal.token_version < current_version:
+                raise credentials_exception
+            return principal
+
+        with timing.phase("user"):
+            user = await load_for_user("user", user_id, db, load_principal)
+        if user is None or payload.get("ver", 0) < user.token_version:
+            raise credentials_exception
         return user
 
+    @app.post("/api/logout")
+    async def logout(current_user: Principal = Depends(get_current_user), db: DB = Depends(session_dependency)):
+        await run_in_session(db, crud.bump_token_version, current_user.id)
+        token_versions.invalidate(current_user.id)
+        return {"message": "Logged out; all access tokens for this account are revoked"}
+
     @app.get("/api/users/me", response_model=UserOut)
-    def read_users_me(current_user: User = Depends(get_current_user)):
+    async def read_users_me(current_user: Principal = Depends(get_current_user)):
+        if FAST_JSON:
+            return json_response(user_encoder.encode(current_user))
         return current_user
 
     @app.post("/api/tasks", response_model=TaskRead, status_code=status.HTTP_201_CREATED)
-    def create_task(task_in: TaskCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_session)):
-        db_task = Task(
-            title=task_in.title,
-            description=task_in.description,
-            completed=(task_in.status == Status.completed),
-            user_id=current_user.id,
-            created_at=datetime.now(timezone.utc),
-            updated_at=datetime.now(timezone.utc)
-        )
-        db.add(db_task)
-        db.commit()
-        db.refresh(db_task)
-        return db_task
+    async def create_task(task_in: TaskCreate, current_user: Principal = Depends(get_current_user), db: DB = Depends(session_dependency)):
+        db_task = new_task_values(task_in, current_user.id, datetime.now(timezone.utc))
+        task = await run_in_session(db, crud.create_task, db_task)
+        await invalidate_task_lists(current_user.id)
+        if FAST_JSON:
+            return json_response(task_encoder.encode(task), status_code=status.HTTP_201_CREATED)
+        return task
+
+    @app.post("/api/tasks/bulk", response_model=BulkTaskResult, status_code=status.HTTP_201_CREATED)
+    async def create_tasks_bulk(
+        items: List[Dict[str, Any]] = Body(...),
+        partial: bool = Query(default=False, description="Insert the valid items even if some are invalid"),
+        current_user: Principal = Depends(get_current_user),
+        db: DB = Depends(session_dependency),
+    ):
+        if len(items) > TASK_BULK_MAX_ITEMS:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"At most {TASK_BULK_MAX_ITEMS} tasks can be created per request",
+            )
+
+        now = datetime.now(timezone.utc)
+        rows, errors = [], []
+        for index, item in enumerate(items):
+            try:
+                rows.append(new_task_values(TaskCreate.model_validate(item), current_user.id, now))
+            except ValidationError as exc:
+                errors.append({"index": index, "errors": jsonable_encoder(exc.errors(include_url=False))})
+        if errors and not partial:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=errors)
+
+        # One multi-row INSERT ... RETURNING in one transaction, rows in input order.
+        created = await run_in_session(db, crud.create_tasks, current_user.id, rows) if rows else []
+        if created:
+            await invalidate_task_lists(current_user.id)
+        if FAST_JSON:
+            with timing.phase("serialize"):
+                content = dumps({"created": [task_encoder.to_dict(task) for task in created], "errors": errors})
+            return json_response(content, status_code=status.HTTP_201_CREATED)
+        return {"created": created, "errors": errors}
 
     @app.get("/api/tasks", response_model=List[TaskRead])
-    def list_tasks(status_filter: Optional[Status] = None, current_user: User = Depends(get_current_user), db: Session = Depends(get_session)):
-        query = select(Task).where(Task.user_id == current_user.id)
-        if status_filter:
-            query = query.where(Task.completed == (status_filter == Status.completed))
-        return db.exec(query).all()
+    async def list_tasks(
+        request: Request,
+        response: Response,
+        status_filter: Optional[Status] = None,
+        limit: int = Query(default=TASK_PAGE_DEFAULT_LIMIT, ge=1),
+        cursor: Optional[str] = None,
+        current_user: Principal = Depends(get_current_user),
+        db: DB = Depends(session_dependency),
+    ):
+        # Keyset pagination: the cursor names the last (created_at, id) seen,
+        # so every page is a bounded index range scan however deep it is.
+        try:
+            after = decode_cursor(cursor) if cursor else None
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+        version, counts = await run_in_session(db, crud.get_task_summary, current_user.id)
+        etag = list_etag(current_user.id, version, request)
+        if etag_matches(request.headers.get("If-None-Match"), etag):
+            return not_modified(etag)
+
+        headers = {
+            "ETag": etag,
+            "X-Total-Count": str(counts[status_filter.value] if status_filter else sum(counts.values())),
+        }
+        query = (current_user.id, status_filter.value if status_filter else None, min(limit, TASK_PAGE_MAX_LIMIT), after)
+
+        def page_headers(tasks: List[Task], has_more: bool) -> Dict[str, str]:
+            if not has_more:
+                return headers
+            next_cursor = encode_cursor(tasks[-1].created_at, tasks[-1].id)
+            return {
+                **headers,
+                "X-Next-Cursor": next_cursor,
+                "Link": f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"',
+            }
+
+        # The page depends only on the user, the collection version and the
+        # query; that is the key for the response cache and for coalescing.
+        # Because it includes the version, a page built before a write is
+        # never served after it.
+        key = f"{version}?{canonical_query(request)}"
+
+        async def render_page():
+            task_cache = cache.task_lists
+            if task_cache is not None:
+                cached = await task_cache.get(current_user.id, key)
+                if cached is not None:
+                    cached_headers, _, body = cached.partition(b"\n")
+                    return json.loads(cached_headers), body
+            tasks, has_more = await run_in_session(db, crud.list_tasks, *query)
+            page = page_headers(tasks, has_more)
+            body = task_fragments.encode_many(tasks)
+            if task_cache is not None:
+                await task_cache.set(current_user.id, key, dumps(page) + b"\n" + body)
+            return page, body
+
+        if FAST_JSON or REQUEST_COALESCING or cache.task_lists is not None:
+            if REQUEST_COALESCING:
+                page, body = await singleflight.reads.run(("tasks", current_user.id, key), render_page)
+            else:
+                page, body = await render_page()
+            return Response(content=body, media_type="application/json", headers=page)
+
+        tasks, has_more = await run_in_session(db, crud.list_tasks, *query)
+        response.headers.update(page_headers(tasks, has_more))
+        return tasks
+
+    def bulk_selection(ids: Optional[List[int]], status_filter: Optional[Status]) -> dict:
+        if ids is None and status_filter is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Select tasks with ids or status_filter",
+            )
+        return {"ids": ids, "status": status_filter.value if status_filter else None}
+
+    @app.post("/api/tasks/import", response_model=ImportSummary)
+    async def import_tasks(
+        request: Request,
+        format: Optional[ExportFormat] = Query(default=None, description="Defaults from Content-Type; NDJSON unless text/csv"),
+        current_user: Principal = Depends(get_current_user),
+        db: DB = Depends(session_dependency),
+    ):
+        # The body is parsed as it arrives and valid rows are written in
+        # batches of TASK_IMPORT_BATCH_SIZE, so memory is bounded by one batch
+        # however large the upload is. Each batch commits on its own.
+        if format is None:
+            is_csv = request.headers.get("content-type", "").startswith("text/csv")
+            format = ExportFormat.csv if is_csv else ExportFormat.ndjson
+        lines = iter_lines(request.stream(), TASK_IMPORT_MAX_RECORD_BYTES)
+        if format == ExportFormat.csv:
+            records = parse_csv(lines, TASK_IMPORT_MAX_RECORD_BYTES)
+        else:
+            records = parse_ndjson(lines)
+
+        batch, inserted, rejected, errors = [], 0, 0, []
+        try:
+            async for line, record in records:
+                try:
+                    if isinstance(record, RecordError):
+                        raise record
+                    # Timestamps are set by crud.import_tasks when the batch is written.
+                    batch.append(new_task_values(TaskCreate.model_validate(record), current_user.id, None))
+                except (ValidationError, RecordError) as exc:
+                    rejected += 1
+                    if len(errors) < TASK_IMPORT_MAX_REPORTED_ERRORS:
+                        details = exc.errors(include_url=False) if isinstance(exc, ValidationError) else [{"msg": str(exc)}]
+                        errors.append({"line": line, "errors": jsonable_encoder(details)})
+                    continue
+                if len(batch) >= TASK_IMPORT_BATCH_SIZE:
+                    inserted += await run_in_session(db, crud.import_tasks, current_user.id, batch)
+                    batch = []
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Upload must be UTF-8 encoded")
+        if batch:
+            inserted += await run_in_session(db, crud.import_tasks, current_user.id, batch)
+        if inserted:
+            await invalidate_task_lists(current_user.id)
+        return {"inserted": inserted, "rejected": rejected, "errors": errors}
+
+    @app.patch("/api/tasks", response_model=BulkTaskChange)
+    async def update_tasks_bulk(task_update: BulkTaskUpdate, current_user: Principal = Depends(get_current_user), db: DB = Depends(session_dependency)):
+        selection = bulk_selection(task_update.ids, task_update.status_filter)
+        values = {"status": task_update.status.value, "completed": task_update.status == Status.completed}
+        ids = await run_in_session(db, crud.update_tasks, current_user.id, values, **selection)
+        if ids:
+            await invalidate_task_lists(current_user.id)
+        return {"affected": len(ids), "ids": ids}
+
+    @app.delete("/api/tasks", response_model=BulkTaskChange)
+    async def delete_tasks_bulk(
+        ids: Optional[List[int]] = Query(default=None, max_length=TASK_BULK_MAX_ITEMS),
+        status_filter: Optional[Status] = None,
+        current_user: Principal = Depends(get_current_user),
+        db: DB = Depends(session_dependency),
+    ):
+        selection = bulk_selection(ids, status_filter)
+        ids = await run_in_session(db, crud.delete_tasks, current_user.id, **selection)
+        if ids:
+            await invalidate_task_lists(current_user.id)
+        return {"affected": len(ids), "ids": ids}
+
+    @app.get("/api/tasks/changes", response_model=TaskChanges)
+    async def list_task_changes(
+        since: Optional[str] = None,
+        limit: int = Query(default=TASK_PAGE_DEFAULT_LIMIT, ge=1),
+        current_user: Principal = Depends(get_current_user),
+        db: DB = Depends(session_dependency),
+    ):
+        # Without a watermark this starts the initial sync: every task, paged
+        # like GET /api/tasks. Until the last page the watermark also carries
+        # the list cursor, so passing it back fetches the next page, and every
+        # page keeps the position taken before the first one. Deletions are
+        # only kept for TASK_SYNC_RETENTION_SECONDS: an older watermark could
+        # miss some, so the client has to sync from scratch.
+        try:
+            since_position, after = decode_watermark(since) if since else (None, None)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid watermark")
+        retained_since = datetime.now(timezone.utc) - timedelta(seconds=TASK_SYNC_RETENTION_SECONDS)
+        if since_position is not None and since_position < retained_since:
+            raise HTTPException(status_code=status.HTTP_410_GONE, detail="Watermark expired; full resync required")
+
+        if since_position is None or after is not None:
+            watermark = since_position or crud.sync_watermark(TASK_SYNC_OVERLAP_SECONDS)
+            changed, has_more = await run_in_session(
+                db, crud.list_tasks, current_user.id, None, min(limit, TASK_PAGE_MAX_LIMIT), after
+            )
+            deleted = []
+            next_cursor = encode_cursor(changed[-1].created_at, changed[-1].id) if has_more else None
+        else:
+            watermark = crud.sync_watermark(TASK_SYNC_OVERLAP_SECONDS)
+            changed, deleted = await run_in_session(db, crud.list_changes, current_user.id, since_position)
+            has_more, next_cursor = False, None
+
+        token = encode_watermark(watermark, next_cursor)
+        if FAST_JSON:
+            with timing.phase("serialize"):
+                content = dumps({
+                    "changed": [task_encoder.to_dict(task) for task in changed],
+                    "deleted": deleted,
+                    "watermark": token,
+                    "has_more": has_more,
+                })
+            return json_response(content)
+        return {"changed": changed, "deleted": deleted, "watermark": token, "has_more": has_more}
+
+    @app.get("/api/tasks/stats", response_model=TaskStats)
+    async def task_stats(request: Request, response: Response, current_user: Principal = Depends(get_current_user), db: DB = Depends(session_dependency)):
+        # Served from the counts kept on the user row; no tasks are counted.
+        version, counts = await run_in_session(db, crud.get_task_summary, current_user.id)
+        etag = list_etag(current_user.id, version, request)
+        if etag_matches(request.headers.get("If-None-Match"), etag):
+            return not_modified(etag)
+        response.headers["ETag"] = etag
+        return {**counts, "total": sum(counts.values())}
+
+    @app.get("/api/tasks/export", response_class=StreamingResponse)
+    async def export_tasks(format: ExportFormat = ExportFormat.ndjson, current_user: Principal = Depends(get_current_user), db: DB = Depends(session_dependency)):
+        # Rows are read through a server-side cursor and encoded one batch at a
+        # time, so memory stays flat and the first batch is sent before the
+        # query has finished. The pinned FastAPI keeps the session open until
+        # the response has been streamed.
+        batches = stream_in_session(db, crud.export_tasks_query(current_user.id), TASK_EXPORT_BATCH_SIZE)
+
+        async def ndjson_chunks():
+            async for batch in batches:
+                yield b"".join(dumps(task_encoder.to_dict(row)) + b"\n" for row in batch)
+
+        async def csv_chunks():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(TASK_FIELDS)
+            async for batch in batches:
+                writer.writerows(
+                    [value.isoformat() if isinstance(value, datetime) else value for value in task_encoder.to_dict(row).values()]
+                    for row in batch
+                )
+                yield buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue().encode()
+
+        if format == ExportFormat.csv:
+            body, media_type = csv_chunks(), "text/csv"
+        else:
+            body, media_type = ndjson_chunks(), "application/x-ndjson"
+        return StreamingResponse(
+            body,
+            media_type=media_type,
+            headers={"Content-Disposition": f'attachment; filename="tasks.{format.value}"'},
+        )
 
     @app.get("/api/tasks/{id}", response_model=TaskRead)
-    def get_task(id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_session)):
-        task = db.exec(select(Task).where(Task.id == id, Task.user_id == current_user.id)).first()
+    async def get_task(id: int, request: Request, response: Response, current_user: Principal = Depends(get_current_user), db: DB = Depends(session_dependency)):
+        if_none_match = request.headers.get("If-None-Match")
+        if if_none_match:
+            version = await run_in_session(db, crud.get_task_version, current_user.id, id)
+            if version is not None and etag_matches(if_none_match, task_etag(id, version)):
+                return not_modified(task_etag(id, version))
+
+        task = await run_in_session(db, crud.get_task, current_user.id, id)
         if not task:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Task not found")
+        response.headers["ETag"] = task_etag(task.id, task.version)
+        if FAST_JSON:
+            return json_response(task_encoder.encode(task), response)
         return task
 
     @app.put("/api/tasks/{id}", response_model=TaskRead)
-    def update_task(id: int, task_update: TaskUpdate, current_user: User = Depends(get_current_user), db: Session = Depends(get_session)):
-        task = db.exec(select(Task).where(Task.id == id, Task.user_id == current_user.id)).first()
+    async def update_task(id: int, task_update: TaskUpdate, request: Request, response: Response, current_user: Principal = Depends(get_current_user), db: DB = Depends(session_dependency)):
+        update_data = task_update.dict(exclude_unset=True)
+        new_status = update_data.pop("status", None)
+        if new_status is not None:
+            update_data["status"] = new_status.value
+            update_data["completed"] = (new_status == Status.completed)
+
+        # Optimistic concurrency: If-Match (or the body's version) turns the
+        # update into UPDATE ... WHERE version = :v.
+        expected_version = if_match_version(request.headers.get("If-Match"), id)
+        body_version = update_data.pop("version", None)
+        if expected_version is None:
+            expected_version = body_version
+
+        task, current = await run_in_session(db, crud.update_task, current_user.id, id, update_data, expected_version)
+        if current is not None:
+            return JSONResponse(
+                status_code=status.HTTP_412_PRECONDITION_FAILED,
+                content=jsonable_encoder(TaskRead.model_validate(current, from_attributes=True)),
+                headers={"ETag": task_etag(current.id, current.version)},
+            )
         if not task:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Task not found")
-        
-        update_data = task_update.dict(exclude_unset=True)
-        if "status" in update_data:
-            task.completed = (update_data["status"] == Status.completed)
-            del update_data["status"]
-            
-        for key, value in update_data.items():
-            setattr(task, key, value)
-        
-        task.updated_at = datetime.now(timezone.utc)
-        db.add(task)
-        db.commit()
-        db.refresh(task)
+        await invalidate_task_lists(current_user.id)
+        response.headers["ETag"] = task_etag(task["id"], task["version"])
+        if FAST_JSON:
+            return json_response(task_encoder.encode(task), response)
         return task
 
     @app.delete("/api/tasks/{id}", status_code=status.HTTP_200_OK)
-    def delete_task(id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_session)):
-        task = db.exec(select(Task).where(Task.id == id, Task.user_id == current_user.id)).first()
-        if not task:
+    async def delete_task(id: int, current_user: Principal = Depends(get_current_user), db: DB = Depends(session_dependency)):
+        if not await run_in_session(db, crud.delete_task, current_user.id, id):
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Task not found")
-        db.delete(task)
-        db.commit()
+        await invalidate_task_lists(current_user.id)
         return {"message": "Task deleted successfully"}
 
     return app
@@ -1,14 +1,185 @@
+from collections import OrderedDict
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Optional, Tuple
+import hashlib
+import threading
+import time
 
 from jose import JWTError, jwt
 from fastapi import HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 
-from config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from config import (
+    SECRET_KEY,
+    ALGORITHM,
+    ACCESS_TOKEN_EXPIRE_MINUTES,
+    TOKEN_VERSION_CACHE_TTL,
+    TOKEN_VERSION_CACHE_SIZE,
+    TOKEN_CACHE_SIZE,
+)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/login")
 
+
+@dataclass(frozen=True)
+class Principal:
+    """
+    The authenticated user as described by the access token, without a database load.
+    """
+    id: str
+    email: str
+    created_at: datetime
+    token_version: int
+
+
+class TokenVersionCache:
+    """
+    Remembers each user's current token version for ``ttl`` seconds, so the
+    revocation check does not need a database round trip on every request.
+
+    Entries are kept in expiry order: expired ones are pruned from the front
+    on every insert, and at most ``maxsize`` (the oldest first) are kept.
+    """
+
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str) -> Optional[int]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            with self._lock:
+                if self._entries.get(user_id) is entry:
+                    del self._entries[user_id]
+            return None
+        return entry[0]
+
+    def set(self, user_id: str, version: int) -> None:
+        if self.maxsize <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._entries[user_id] = (version, now + self.ttl)
+            while self._entries:
+                oldest, (_, expires_at) = next(iter(self._entries.items()))
+                if expires_at > now and len(self._entries) <= self.maxsize:
+                    break
+                del self._entries[oldest]
+
+    def invalidate(self, user_id: str) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+token_versions = TokenVersionCache(TOKEN_VERSION_CACHE_TTL, TOKEN_VERSION_CACHE_SIZE)
+
+
+class VerifiedTokenCache:
+    """
+    Bounded LRU of already-verified token payloads, keyed by a SHA-256 digest
+    of the token. Each entry expires at its token's ``exp`` claim.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries: "OrderedDict[bytes, Tuple[dict, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: bytes) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            payload, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return payload
+
+    def set(self, key: bytes, payload: dict, expires_at: float) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (payload, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+verified_tokens = VerifiedTokenCache(TOKEN_CACHE_SIZE)
+
+
+def token_claims(user) -> dict:
+    """
+    Returns the claims that let a token stand in for the user record.
+    """
+    return {
+        "sub": user.id,
+        "email": user.email,
+        "created_at": user.created_at.isoformat(),
+        "ver": user.token_version or 0,
+    }
+
+
+def principal_from_payload(payload: dict) -> Optional[Principal]:
+    """
+    Builds a Principal from a verified token payload, or returns None if the
+    token predates the stateless claims.
+    """
+    try:
+        return Principal(
+            id=payload["sub"],
+            email=payload["email"],
+            created_at=datetime.fromisoformat(payload["created_at"]),
+            token_version=int(payload["ver"]),
+        )
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def principal_from_user(user) -> Principal:
+    """
+    Copies the fields handlers need from a loaded user row into a Principal,
+    which stays valid after the row's session is rolled back or closed.
+    """
+    return Principal(
+        id=user.id,
+        email=user.email,
+        created_at=user.created_at,
+        token_version=user.token_version or 0,
+    )
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """
     Creates a JWT access token.
@@ -26,7 +197,15 @@ def verify_token(token: str):
     """
     Verifies a JWT token and returns the payload.
     Raises HTTPException if token is invalid or expired.
+
+    Verified payloads are cached until the token expires; callers must treat
+    the returned dict as read-only.
     """
+    cache_key = hashlib.sha256(token.encode()).digest()
+    cached = verified_tokens.get(cache_key)
+    if cached is not None:
+        return cached
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
@@ -36,6 +215,8 @@ def verify_token(token: str):
                 detail="Could not validate credentials",
                 headers={"WWW-Authenticate": "Bearer"},
             )
+        if "exp" in payload:
+            verified_tokens.set(cache_key, payload, payload["exp"])
         return payload
     except JWTError:
         raise HTTPException(
@@ -0,0 +1,49 @@
+"""
+Per-item cost of assembling task list responses from cached fragments.
+
+Compares a full encode of the list (serialization.task_encoder) with
+serialization.FragmentCache in three states:
+- cold: every task is encoded and stored;
+- warm: every task is already cached;
+- churn: 1% of the tasks changed since the last request.
+
+Usage (from the repository root):
+    python benchmarks/bench_fragments.py
+"""
+from bench_serialization import best_of, make_tasks
+
+from serialization import FragmentCache, task_encoder
+
+SIZES = (100, 1_000, 10_000, 50_000)
+KEY_FIELDS = ("id", "version", "created_at")
+
+
+def main() -> None:
+    print(f"{'tasks':>8} {'full us/item':>13} {'cold us/item':>13} {'warm us/item':>13} {'churn us/item':>14} {'warm speedup':>13}")
+    for size in SIZES:
+        tasks = make_tasks(size)
+        repeat = 5 if size >= 10_000 else 50
+        max_bytes = 4 * len(task_encoder.encode_many(tasks))
+
+        full = best_of(lambda: task_encoder.encode_many(tasks), repeat)
+        cold = best_of(lambda: FragmentCache(task_encoder, KEY_FIELDS, max_bytes).encode_many(tasks), repeat)
+
+        fragments = FragmentCache(task_encoder, KEY_FIELDS, max_bytes)
+        fragments.encode_many(tasks)
+        warm = best_of(lambda: fragments.encode_many(tasks), repeat)
+
+        def churn():
+            for task in tasks[:: 100]:
+                task.version += 1
+            fragments.encode_many(tasks)
+
+        churned = best_of(churn, repeat)
+        assert fragments.encode_many(tasks) == task_encoder.encode_many(tasks)
+        print(
+            f"{size:>8} {full / size * 1e6:>13.2f} {cold / size * 1e6:>13.2f} "
+            f"{warm / size * 1e6:>13.2f} {churned / size * 1e6:>14.2f} {full / warm:>12.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
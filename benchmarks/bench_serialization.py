@@ -0,0 +1,84 @@
+"""
+Per-item cost of serializing task list responses.
+
+Compares FastAPI's default path (response_model validation into TaskRead,
+serialization to JSON-able data, then JSONResponse's json.dumps) with the
+FAST_JSON path (serialization.task_encoder straight to bytes).
+
+Usage (from the repository root):
+    python benchmarks/bench_serialization.py
+"""
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute, serialize_response
+
+from app import app
+from models import Task
+from serialization import task_encoder
+
+SIZES = (10, 1_000, 50_000)
+
+
+def make_tasks(count: int) -> list:
+    now = datetime.now(timezone.utc)
+    return [
+        Task(
+            id=i,
+            user_id="4f9d7c1e-0000-4000-8000-000000000000",
+            title=f"Task number {i}",
+            description="Some description text" if i % 2 else None,
+            completed=bool(i % 3 == 0),
+            created_at=now + timedelta(seconds=i),
+            updated_at=now + timedelta(seconds=i),
+            version=1,
+        )
+        for i in range(count)
+    ]
+
+
+def list_route() -> APIRoute:
+    return next(
+        route for route in app.routes
+        if isinstance(route, APIRoute) and route.path == "/api/tasks" and "GET" in route.methods
+    )
+
+
+def best_of(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main() -> None:
+    field = list_route().response_field
+    loop = asyncio.new_event_loop()
+
+    def default_path(tasks):
+        content = loop.run_until_complete(serialize_response(field=field, response_content=tasks))
+        return JSONResponse(content).body
+
+    def fast_path(tasks):
+        return task_encoder.encode_many(tasks)
+
+    print(f"{'tasks':>8} {'default us/item':>16} {'fast us/item':>13} {'speedup':>8}")
+    for size in SIZES:
+        tasks = make_tasks(size)
+        repeat = 5 if size >= 10_000 else 50
+        default = best_of(lambda: default_path(tasks), repeat)
+        fast = best_of(lambda: fast_path(tasks), repeat)
+        print(f"{size:>8} {default / size * 1e6:>16.2f} {fast / size * 1e6:>13.2f} {default / fast:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
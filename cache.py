@@ -0,0 +1,265 @@
+"""
+Cache for pre-serialized responses.
+
+Entries are grouped by namespace (a user id) so that all of a user's entries
+can be dropped at once. Two backends are available:
+
+* ``MemoryCache``: an in-process LRU bounded by a byte budget. Each worker
+  process has its own.
+* ``RedisCache``: any server speaking the Redis protocol. Each namespace is one
+  hash, so a lookup, a store or an invalidation is one round trip. Backend
+  errors count as misses and are never raised to the caller.
+
+Callers put everything that determines an entry's content into its key (the
+task list cache includes the user's tasks version), so an entry written late
+by a slow request can never be served after a newer write.
+"""
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+import asyncio
+import threading
+import time
+
+from config import TASK_CACHE_BACKEND, TASK_CACHE_MAX_BYTES, TASK_CACHE_TTL, TASK_CACHE_URL
+
+
+def _hit_ratio(hits: int, misses: int) -> float:
+    lookups = hits + misses
+    return hits / lookups if lookups else 0.0
+
+
+class MemoryCache:
+    """
+    LRU of byte strings bounded by ``max_bytes`` (keys and values counted),
+    with entries expiring after ``ttl`` seconds.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.bytes = 0
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[bytes, float]]" = OrderedDict()
+        self._namespaces: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size(namespace: str, key: str, value: bytes) -> int:
+        return len(namespace) + len(key) + len(value)
+
+    def _remove(self, namespace: str, key: str) -> None:
+        value, _ = self._entries.pop((namespace, key))
+        self.bytes -= self._size(namespace, key, value)
+        keys = self._namespaces[namespace]
+        keys.discard(key)
+        if not keys:
+            del self._namespaces[namespace]
+
+    async def get(self, namespace: str, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None:
+                    self._remove(namespace, key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end((namespace, key))
+            self.hits += 1
+            return entry[0]
+
+    async def set(self, namespace: str, key: str, value: bytes) -> None:
+        size = self._size(namespace, key, value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if (namespace, key) in self._entries:
+                self._remove(namespace, key)
+            self._entries[(namespace, key)] = (value, time.monotonic() + self.ttl)
+            self._namespaces.setdefault(namespace, set()).add(key)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                (old_namespace, old_key), _ = next(iter(self._entries.items()))
+                self._remove(old_namespace, old_key)
+                self.evictions += 1
+
+    async def invalidate(self, namespace: str) -> None:
+        with self._lock:
+            for key in list(self._namespaces.get(namespace, ())):
+                self._remove(namespace, key)
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        return {
+            "backend": "memory",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": _hit_ratio(self.hits, self.misses),
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+class RedisError(Exception):
+    pass
+
+
+class _RedisConnection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    async def execute(self, *commands: Tuple) -> List:
+        """
+        Sends the commands in one write (pipelined) and returns their replies.
+        """
+        out = bytearray()
+        for command in commands:
+            out += b"*%d\r\n" % len(command)
+            for arg in command:
+                arg = arg if isinstance(arg, bytes) else str(arg).encode()
+                out += b"$%d\r\n%s\r\n" % (len(arg), arg)
+        self.writer.write(out)
+        await self.writer.drain()
+        replies = [await self._read_reply() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    async def _read_reply(self):
+        line = await self.reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Connection closed by the cache server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest
+        if kind == b"-":
+            return RedisError(rest.decode(errors="replace"))
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = await self.reader.readexactly(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(rest)
+            return None if length < 0 else [await self._read_reply() for _ in range(length)]
+        raise RedisError(f"Unexpected reply from the cache server: {line!r}")
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class RedisCache:
+    """
+    Minimal asyncio client for a Redis-protocol server, with a small pool of
+    connections. ``url`` is ``redis://[:password@]host[:port][/db]``.
+    """
+
+    def __init__(self, url: str, ttl: float, timeout: float = 0.5, max_idle: int = 8):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.ttl = ttl
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.invalidations = 0
+        self._idle: List[_RedisConnection] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @staticmethod
+    def _key(namespace: str) -> str:
+        return f"todo:tasks:{namespace}"
+
+    async def _connect(self) -> _RedisConnection:
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        connection = _RedisConnection(reader, writer)
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            await connection.execute(*setup)
+        return connection
+
+    async def _execute(self, *commands: Tuple) -> Optional[List]:
+        # Connections belong to the event loop that opened them.
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop, self._idle = loop, []
+        connection = self._idle.pop() if self._idle else None
+        try:
+            if connection is None:
+                connection = await asyncio.wait_for(self._connect(), self.timeout)
+            replies = await asyncio.wait_for(connection.execute(*commands), self.timeout)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, RedisError):
+            # The connection may be mid-reply; never reuse it.
+            if connection is not None:
+                connection.close()
+            self.errors += 1
+            return None
+        if len(self._idle) < self.max_idle:
+            self._idle.append(connection)
+        else:
+            connection.close()
+        return replies
+
+    async def get(self, namespace: str, key: str) -> Optional[bytes]:
+        replies = await self._execute(("HGET", self._key(namespace), key))
+        value = replies[0] if replies else None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, namespace: str, key: str, value: bytes) -> None:
+        name = self._key(namespace)
+        await self._execute(("HSET", name, key, value), ("EXPIRE", name, max(1, int(self.ttl))))
+
+    async def invalidate(self, namespace: str) -> None:
+        await self._execute(("DEL", self._key(namespace)))
+        self.invalidations += 1
+
+    def stats(self) -> dict:
+        return {
+            "backend": "redis",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": _hit_ratio(self.hits, self.misses),
+            "errors": self.errors,
+            "invalidations": self.invalidations,
+        }
+
+
+def create_cache(backend: str):
+    """
+    Builds the cache configured by TASK_CACHE_*, or returns None when caching
+    is off.
+    """
+    if backend == "memory":
+        return MemoryCache(TASK_CACHE_MAX_BYTES, TASK_CACHE_TTL)
+    if backend == "redis":
+        return RedisCache(TASK_CACHE_URL, TASK_CACHE_TTL)
+    if backend in ("", "none"):
+        return None
+    raise ValueError(f"Unknown TASK_CACHE_BACKEND '{backend}'.")
+
+
+# Pre-serialized GET /api/tasks responses, one namespace per user
+task_lists = create_cache(TASK_CACHE_BACKEND)
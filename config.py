@@ -11,3 +11,109 @@ if not SECRET_KEY:
 
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
+# Build the current user from token claims instead of loading it on every request
+AUTH_STATELESS = os.getenv("AUTH_STATELESS", "false").lower() in ("1", "true", "yes")
+# How long a user's token version is trusted before it is re-read from the database
+TOKEN_VERSION_CACHE_TTL = int(os.getenv("TOKEN_VERSION_CACHE_TTL", 30))  # seconds
+# Maximum number of users whose token version is cached (0 disables the cache)
+TOKEN_VERSION_CACHE_SIZE = int(os.getenv("TOKEN_VERSION_CACHE_SIZE", 10000))
+# Maximum number of verified access tokens kept in memory (0 disables the cache)
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 10000))
+
+# Password hashing executor: "thread" or "process" pool, its size, and how many
+# hashing jobs may be queued or running before requests are rejected with 503
+HASH_EXECUTOR = os.getenv("HASH_EXECUTOR", "thread").lower()
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", 2))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", 32))
+
+# Configuration for the database engine and its connection pool
+DATABASE_URL = os.getenv("DATABASE_URL")
+# Serve requests through AsyncSession (asyncpg / aiosqlite) instead of the threadpool
+DATABASE_ASYNC = os.getenv("DATABASE_ASYNC", "false").lower() in ("1", "true", "yes")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))  # seconds
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))  # seconds
+
+# GET /api/tasks page size: used when the client sends no limit, and the upper bound
+TASK_PAGE_DEFAULT_LIMIT = int(os.getenv("TASK_PAGE_DEFAULT_LIMIT", 100))
+TASK_PAGE_MAX_LIMIT = int(os.getenv("TASK_PAGE_MAX_LIMIT", 500))
+
+# Maximum number of tasks accepted by POST /api/tasks/bulk
+TASK_BULK_MAX_ITEMS = int(os.getenv("TASK_BULK_MAX_ITEMS", 500))
+
+# Rows fetched per server-side cursor round trip by GET /api/tasks/export
+TASK_EXPORT_BATCH_SIZE = int(os.getenv("TASK_EXPORT_BATCH_SIZE", 1000))
+
+# POST /api/tasks/import: rows written per batch, and how many rejected rows are
+# described in the response (all of them are counted)
+TASK_IMPORT_BATCH_SIZE = int(os.getenv("TASK_IMPORT_BATCH_SIZE", 1000))
+TASK_IMPORT_MAX_REPORTED_ERRORS = int(os.getenv("TASK_IMPORT_MAX_REPORTED_ERRORS", 100))
+# Longest line (NDJSON) or row (CSV, across quoted line breaks) accepted by the
+# import, in bytes; longer ones are rejected as row errors
+TASK_IMPORT_MAX_RECORD_BYTES = int(os.getenv("TASK_IMPORT_MAX_RECORD_BYTES", 64 * 1024))
+
+# GET /api/tasks/changes moves each watermark back by this many seconds, so writes
+# that commit late are picked up by the next poll
+TASK_SYNC_OVERLAP_SECONDS = float(os.getenv("TASK_SYNC_OVERLAP_SECONDS", 5))
+# Deleted tasks are reported to delta sync for this long; older watermarks are
+# answered with 410 and the client must sync from scratch
+TASK_SYNC_RETENTION_SECONDS = float(os.getenv("TASK_SYNC_RETENTION_SECONDS", 30 * 24 * 3600))
+
+# Encode task and user responses straight to JSON bytes with orjson, skipping
+# response_model validation of rows that come from our own database
+FAST_JSON = os.getenv("FAST_JSON", "false").lower() in ("1", "true", "yes")
+
+# Cache of pre-serialized GET /api/tasks responses: "none", "memory" (per
+# worker process, LRU bounded by TASK_CACHE_MAX_BYTES) or "redis" (shared,
+# at TASK_CACHE_URL). Entries expire after TASK_CACHE_TTL seconds.
+TASK_CACHE_BACKEND = os.getenv("TASK_CACHE_BACKEND", "none").lower()
+TASK_CACHE_MAX_BYTES = int(os.getenv("TASK_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+TASK_CACHE_TTL = float(os.getenv("TASK_CACHE_TTL", 300))
+TASK_CACHE_URL = os.getenv("TASK_CACHE_URL", "redis://localhost:6379/0")
+
+# Response compression. Encodings in server preference order (leave empty to
+# disable compression); zstd and br need the zstandard and brotli packages.
+# Responses smaller than COMPRESSION_MINIMUM_SIZE bytes, or of a media type not
+# listed in COMPRESSION_CONTENT_TYPES ("type/*" matches a whole type), are sent
+# as is. Higher levels give smaller responses for more CPU time.
+COMPRESSION_ENCODINGS = [e.strip() for e in os.getenv("COMPRESSION_ENCODINGS", "zstd,br,gzip").split(",") if e.strip()]
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", 1024))
+COMPRESSION_CONTENT_TYPES = os.getenv(
+    "COMPRESSION_CONTENT_TYPES", "application/json,application/x-ndjson,text/*"
+).split(",")
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", 6))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", 4))
+COMPRESSION_ZSTD_LEVEL = int(os.getenv("COMPRESSION_ZSTD_LEVEL", 3))
+
+# Identical concurrent reads share one execution: the current-user load, and
+# GET /api/tasks pages (key: user, task collection version and query)
+REQUEST_COALESCING = os.getenv("REQUEST_COALESCING", "false").lower() in ("1", "true", "yes")
+
+# Encoded JSON of individual tasks, reused to assemble list responses (with
+# FAST_JSON or TASK_CACHE_BACKEND). Only new or changed tasks are re-encoded.
+# 0 disables it.
+TASK_FRAGMENT_CACHE_MAX_BYTES = int(os.getenv("TASK_FRAGMENT_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+
+# Prometheus metrics at GET /metrics (off by default). With several worker
+# processes, set METRICS_MULTIPROC_DIR to a directory shared by them and emptied
+# on each deploy: every worker writes its values there every
+# METRICS_FLUSH_INTERVAL seconds, and /metrics reports the sum over all workers.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() in ("1", "true", "yes")
+METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR", "")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 5))  # seconds
+
+# Server-Timing response header with per-phase durations (auth, user load,
+# database, hashing, serialization). Added to a SERVER_TIMING_SAMPLE_RATE
+# fraction of responses, and to every response to a request that carries the
+# SERVER_TIMING_DEBUG_HEADER header (leave empty to disable it).
+SERVER_TIMING_SAMPLE_RATE = float(os.getenv("SERVER_TIMING_SAMPLE_RATE", 0))
+SERVER_TIMING_DEBUG_HEADER = os.getenv("SERVER_TIMING_DEBUG_HEADER", "")
+
+# SQL query logging (off by default). When enabled, a SQL_LOG_SAMPLE_RATE
+# fraction of statements is logged, and statements slower than SQL_LOG_SLOW_MS
+# are always logged.
+SQL_LOG_ENABLED = os.getenv("SQL_LOG_ENABLED", "false").lower() in ("1", "true", "yes")
+SQL_LOG_SAMPLE_RATE = float(os.getenv("SQL_LOG_SAMPLE_RATE", 0.01))
+SQL_LOG_SLOW_MS = float(os.getenv("SQL_LOG_SLOW_MS", 200))
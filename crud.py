@@ -0,0 +1,454 @@
+"""
+Database access helpers shared by the API endpoints.
+
+Every helper takes a synchronous SQLModel ``Session`` as its first argument so
+that the same code serves both database modes: it runs in the threadpool for a
+regular ``Session`` and on the event loop (through ``AsyncSession.run_sync``)
+for an ``AsyncSession``. See ``database.run_in_session``.
+"""
+from typing import Dict, List, Mapping, Optional, Tuple
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+import io
+
+from sqlalchemy import delete, func, insert, select as sa_select, tuple_, update
+from sqlmodel import Session, select
+
+from config import TASK_SYNC_RETENTION_SECONDS
+from models import TASK_STATUSES, User, Task, TaskTombstone
+
+# Writes go through the Core table: the rows come back from RETURNING, so there
+# is no ORM identity map to synchronise and no refresh SELECT afterwards.
+tasks_table = Task.__table__
+tombstones_table = TaskTombstone.__table__
+users_table = User.__table__
+
+# Tombstones outlive the sync retention window by this margin, so a poll
+# accepted just inside the window cannot lose ones pruned while it runs.
+_TOMBSTONE_PRUNE_GRACE = timedelta(hours=1)
+
+
+def _count_column(status: str):
+    return users_table.c[f"{status}_count"]
+
+
+def _bump_tasks_version(db: Session, user_id: str, count_changes: Optional[Mapping[str, int]] = None) -> None:
+    # Runs inside the write's transaction, so the collection version and the
+    # per-status counts change exactly when the write commits.
+    values = {"tasks_version": users_table.c.tasks_version + 1}
+    for task_status, change in (count_changes or {}).items():
+        if change:
+            values[f"{task_status}_count"] = _count_column(task_status) + change
+    db.exec(update(users_table).where(users_table.c.id == user_id).values(**values))
+
+
+def _status_changes(rows) -> Counter:
+    # Count changes for rows carrying their new status and "previous_status".
+    changes = Counter()
+    for row in rows:
+        if row["previous_status"] != row["status"]:
+            changes[row["previous_status"]] -= 1
+            changes[row["status"]] += 1
+    return changes
+
+
+def _update_returning_previous_status(db: Session, criteria: list, values: dict, returning: list) -> list:
+    """
+    Runs the UPDATE and returns its rows, each with the status it had before
+    as "previous_status".
+    """
+    statement = update(tasks_table).where(*criteria).values(**values)
+    if db.connection().dialect.name == "postgresql":
+        # Still one statement: join the locked pre-update rows, whose status
+        # RETURNING can read.
+        previous = (
+            sa_select(tasks_table.c.id, tasks_table.c.status)
+            .where(*criteria)
+            .with_for_update()
+            .subquery("previous")
+        )
+        statement = statement.where(tasks_table.c.id == previous.c.id)
+        return db.exec(statement.returning(*returning, previous.c.status.label("previous_status"))).mappings().all()
+
+    # SQLite cannot return columns of other tables, so read the statuses
+    # first; it runs one writer at a time, so they cannot change in between.
+    previous = dict(db.exec(sa_select(tasks_table.c.id, tasks_table.c.status).where(*criteria)).all())
+    rows = db.exec(statement.returning(*returning)).mappings().all()
+    return [{**row, "previous_status": previous[row["id"]]} for row in rows]
+
+
+def _record_deletions(db: Session, user_id: str, task_ids: List[int]) -> None:
+    # The user's expired tombstones are pruned in the same transaction, so
+    # the table stays bounded by the deletions within the retention window.
+    now = datetime.now(timezone.utc)
+    cutoff = now - timedelta(seconds=TASK_SYNC_RETENTION_SECONDS) - _TOMBSTONE_PRUNE_GRACE
+    db.exec(
+        delete(tombstones_table)
+        .where(tombstones_table.c.user_id == user_id, tombstones_table.c.deleted_at < cutoff)
+    )
+    db.exec(
+        insert(tombstones_table),
+        params=[{"task_id": task_id, "user_id": user_id, "deleted_at": now} for task_id in task_ids],
+    )
+
+
+def get_user(db: Session, user_id: str) -> Optional[User]:
+    return db.exec(select(User).where(User.id == user_id)).first()
+
+
+def get_user_by_email(db: Session, email: str) -> Optional[User]:
+    return db.exec(select(User).where(User.email == email)).first()
+
+
+def get_task_summary(db: Session, user_id: str) -> Optional[Tuple[int, Dict[str, int]]]:
+    """
+    Returns the user's task collection version and task count per status,
+    read from the user row without counting tasks.
+    """
+    row = db.exec(
+        sa_select(users_table.c.tasks_version, *[_count_column(s) for s in TASK_STATUSES])
+        .where(users_table.c.id == user_id)
+    ).first()
+    if row is None:
+        return None
+    return row[0], dict(zip(TASK_STATUSES, row[1:]))
+
+
+def get_token_version(db: Session, user_id: str) -> Optional[int]:
+    return db.exec(select(User.token_version).where(User.id == user_id)).first()
+
+
+def bump_token_version(db: Session, user_id: str) -> None:
+    """
+    Revokes every access token issued to the user so far.
+    """
+    db.exec(update(User).where(User.id == user_id).values(token_version=User.token_version + 1))
+    db.commit()
+
+
+def create_user(db: Session, user: User) -> User:
+    db.add(user)
+    db.commit()
+    db.refresh(user)
+    return user
+
+
+def list_tasks(
+    db: Session,
+    user_id: str,
+    status: Optional[str] = None,
+    limit: Optional[int] = None,
+    after: Optional[Tuple[datetime, int]] = None,
+) -> Tuple[List[Task], bool]:
+    """
+    Returns up to ``limit`` of the user's tasks in ``(created_at, id)`` order,
+    starting after the ``after`` position, and whether more tasks follow.
+    """
+    query = select(Task).where(Task.user_id == user_id)
+    if status is not None:
+        query = query.where(Task.status == status)
+    if after is not None:
+        query = query.where(tuple_(Task.created_at, Task.id) > tuple_(*after))
+    query = query.order_by(Task.created_at, Task.id)
+    if limit is None:
+        return db.exec(query).all(), False
+
+    tasks = db.exec(query.limit(limit + 1)).all()
+    return tasks[:limit], len(tasks) > limit
+
+
+def get_task(db: Session, user_id: str, task_id: int) -> Optional[Task]:
+    return db.exec(select(Task).where(Task.id == task_id, Task.user_id == user_id)).first()
+
+
+def get_task_version(db: Session, user_id: str, task_id: int) -> Optional[int]:
+    return db.exec(select(Task.version).where(Task.id == task_id, Task.user_id == user_id)).first()
+
+
+def create_task(db: Session, values: dict) -> dict:
+    """
+    Inserts a task and returns the stored row, in one INSERT ... RETURNING.
+    """
+    row = db.exec(insert(tasks_table).values(**values).returning(*tasks_table.c)).mappings().one()
+    _bump_tasks_version(db, values["user_id"], {row["status"]: 1})
+    db.commit()
+    return dict(row)
+
+
+def create_tasks(db: Session, user_id: str, rows: List[dict]) -> List[dict]:
+    """
+    Inserts several tasks in one multi-row INSERT ... RETURNING and one
+    transaction, and returns the stored rows in input order.
+    """
+    result = db.exec(
+        insert(tasks_table).returning(*tasks_table.c, sort_by_parameter_order=True),
+        params=rows,
+    )
+    created = [dict(row) for row in result.mappings()]
+    _bump_tasks_version(db, user_id, Counter(row["status"] for row in created))
+    db.commit()
+    return created
+
+
+_COPY_COLUMNS = ("user_id", "title", "description", "status", "completed", "created_at", "updated_at")
+
+
+def _copy_field(value) -> str:
+    # COPY's CSV format reads an unquoted empty field as NULL and a quoted one
+    # as a value, so every value is quoted and no string can pass for NULL.
+    if value is None:
+        return ""
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def _copy_buffer(rows: List[dict]) -> io.StringIO:
+    """
+    Returns the rows as CSV for COPY FROM STDIN, in ``_COPY_COLUMNS`` order.
+    """
+    buffer = io.StringIO()
+    for row in rows:
+        # COPY skips the column types, so the status is written as its stored number.
+        row = {**row, "status": TASK_STATUSES.index(row["status"])}
+        buffer.write(",".join(_copy_field(row[column]) for column in _COPY_COLUMNS) + "\n")
+    buffer.seek(0)
+    return buffer
+
+
+def _copy_tasks(db: Session, rows: List[dict]) -> None:
+    # PostgreSQL COPY through psycopg2: one round trip per batch and none of
+    # the per-row statement overhead of an INSERT. Omitted columns (id,
+    # version) take their defaults.
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {tasks_table.name} ({', '.join(_COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+            _copy_buffer(rows),
+        )
+    finally:
+        cursor.close()
+
+
+def import_tasks(db: Session, user_id: str, rows: List[dict]) -> int:
+    """
+    Inserts one batch of imported tasks in its own transaction and returns
+    how many were inserted. Uses COPY on PostgreSQL (psycopg2) and a single
+    executemany INSERT elsewhere.
+
+    The rows are stamped with the time of this batch, not of the start of the
+    import: a delta sync that ran while earlier batches were committing must
+    still see this one.
+    """
+    now = datetime.now(timezone.utc)
+    for row in rows:
+        row["created_at"] = row["updated_at"] = now
+    dialect = db.connection().dialect
+    if dialect.name == "postgresql" and dialect.driver == "psycopg2":
+        _copy_tasks(db, rows)
+    else:
+        db.exec(insert(tasks_table), params=rows)
+    _bump_tasks_version(db, user_id, Counter(row["status"] for row in rows))
+    db.commit()
+    return len(rows)
+
+
+def _task_selection(user_id: str, ids: Optional[List[int]], status: Optional[str]) -> list:
+    criteria = [tasks_table.c.user_id == user_id]
+    if ids is not None:
+        criteria.append(tasks_table.c.id.in_(ids))
+    if status is not None:
+        criteria.append(tasks_table.c.status == status)
+    return criteria
+
+
+def update_tasks(
+    db: Session,
+    user_id: str,
+    values: dict,
+    ids: Optional[List[int]] = None,
+    status: Optional[str] = None,
+) -> List[int]:
+    """
+    Applies ``values`` to every task of the user selected by ``ids`` and/or
+    ``status`` in one set-based UPDATE, and returns the affected ids.
+    """
+    criteria = _task_selection(user_id, ids, status)
+    values = {**values, "updated_at": datetime.now(timezone.utc), "version": tasks_table.c.version + 1}
+    if "status" in values and status is None:
+        rows = _update_returning_previous_status(db, criteria, values, [tasks_table.c.id, tasks_table.c.status])
+        affected, count_changes = [row["id"] for row in rows], _status_changes(rows)
+    else:
+        result = db.exec(update(tasks_table).where(*criteria).values(**values).returning(tasks_table.c.id))
+        affected = list(result.scalars())
+        count_changes = None
+        # Selected by status, so every affected task had that status before.
+        if "status" in values and values["status"] != status:
+            count_changes = {status: -len(affected), values["status"]: len(affected)}
+    if affected:
+        _bump_tasks_version(db, user_id, count_changes)
+    db.commit()
+    return affected
+
+
+def update_task(
+    db: Session,
+    user_id: str,
+    task_id: int,
+    values: dict,
+    expected_version: Optional[int] = None,
+) -> Tuple[Optional[dict], Optional[Task]]:
+    """
+    Applies ``values`` to the task in one UPDATE ... RETURNING and returns
+    ``(updated_row, None)``.
+
+    With ``expected_version`` the update only applies if the task is still at
+    that version. When nothing is updated the result is ``(None, current_task)``
+    if the task exists at another version, or ``(None, None)`` if the user has
+    no such task; only this failure path costs a second query.
+    """
+    criteria = [tasks_table.c.id == task_id, tasks_table.c.user_id == user_id]
+    if expected_version is not None:
+        criteria.append(tasks_table.c.version == expected_version)
+    values = {**values, "updated_at": datetime.now(timezone.utc), "version": tasks_table.c.version + 1}
+    count_changes = None
+    if "status" in values:
+        rows = _update_returning_previous_status(db, criteria, values, list(tasks_table.c))
+        row = rows[0] if rows else None
+        count_changes = _status_changes(rows)
+    else:
+        row = db.exec(update(tasks_table).where(*criteria).values(**values).returning(*tasks_table.c)).mappings().first()
+    if row is None:
+        db.rollback()
+        current = get_task(db, user_id, task_id) if expected_version is not None else None
+        return None, current
+
+    _bump_tasks_version(db, user_id, count_changes)
+    db.commit()
+    row = dict(row)
+    row.pop("previous_status", None)
+    return row, None
+
+
+def delete_task(db: Session, user_id: str, task_id: int) -> bool:
+    """
+    Deletes the task and returns True, or False if the user has no such task,
+    in one DELETE ... RETURNING.
+    """
+    deleted = db.exec(
+        delete(tasks_table)
+        .where(tasks_table.c.id == task_id, tasks_table.c.user_id == user_id)
+        .returning(tasks_table.c.id, tasks_table.c.status)
+    ).first()
+    if deleted is not None:
+        _record_deletions(db, user_id, [deleted.id])
+        _bump_tasks_version(db, user_id, {deleted.status: -1})
+    db.commit()
+    return deleted is not None
+
+
+def delete_tasks(
+    db: Session,
+    user_id: str,
+    ids: Optional[List[int]] = None,
+    status: Optional[str] = None,
+) -> List[int]:
+    """
+    Deletes every task of the user selected by ``ids`` and/or ``status``
+    in one set-based DELETE, and returns the deleted ids.
+    """
+    rows = db.exec(
+        delete(tasks_table)
+        .where(*_task_selection(user_id, ids, status))
+        .returning(tasks_table.c.id, tasks_table.c.status)
+    ).all()
+    deleted = [row.id for row in rows]
+    if deleted:
+        _record_deletions(db, user_id, deleted)
+        count_changes = Counter()
+        for row in rows:
+            count_changes[row.status] -= 1
+        _bump_tasks_version(db, user_id, count_changes)
+    db.commit()
+    return deleted
+
+
+def export_tasks_query(user_id: str):
+    """
+    Returns the statement that reads every task of the user for an export,
+    as plain rows in list order.
+    """
+    return (
+        sa_select(tasks_table)
+        .where(tasks_table.c.user_id == user_id)
+        .order_by(tasks_table.c.created_at, tasks_table.c.id)
+    )
+
+
+def sync_watermark(overlap: float) -> datetime:
+    """
+    Returns the watermark for changes read from now on.
+
+    It is taken before querying and moved back by ``overlap`` seconds, so a
+    write that committed late with an earlier timestamp is delivered on the
+    next poll. Clients may see a change twice, never miss one.
+    """
+    return datetime.now(timezone.utc) - timedelta(seconds=overlap)
+
+
+def list_changes(db: Session, user_id: str, since: datetime) -> Tuple[List[Task], List[int]]:
+    """
+    Returns the user's tasks updated after ``since`` and the ids of tasks
+    deleted after it.
+    """
+    changed = db.exec(
+        select(Task).where(Task.user_id == user_id, Task.updated_at > since).order_by(Task.updated_at, Task.id)
+    ).all()
+    deleted = db.exec(
+        select(TaskTombstone.task_id)
+        .where(TaskTombstone.user_id == user_id, TaskTombstone.deleted_at > since)
+        .order_by(TaskTombstone.deleted_at)
+    ).all()
+    return changed, list(deleted)
+
+
+def reconcile_task_counts(db: Session, user_id: str, repair: bool = True) -> Optional[Tuple[Dict[str, int], Dict[str, int]]]:
+    """
+    Recounts the user's tasks per status and compares them with the stored
+    counts. Returns ``(stored, actual)`` if they differ, otherwise None; with
+    ``repair`` the stored counts are overwritten with the actual ones, and the
+    tasks version is bumped so ETags and cached lists built from the drifted
+    counts are not served again.
+
+    The user row is locked first. Task writes update that row before they
+    commit, so none can land between the recount and the repair.
+    """
+    stored_row = db.exec(
+        sa_select(*[_count_column(s) for s in TASK_STATUSES])
+        .where(users_table.c.id == user_id)
+        .with_for_update()
+    ).first()
+    if stored_row is None:
+        db.rollback()
+        return None
+    stored = dict(zip(TASK_STATUSES, stored_row))
+    actual = dict.fromkeys(TASK_STATUSES, 0)
+    actual.update(db.exec(
+        sa_select(tasks_table.c.status, func.count())
+        .where(tasks_table.c.user_id == user_id)
+        .group_by(tasks_table.c.status)
+    ).all())
+    if stored == actual:
+        db.rollback()
+        return None
+    if repair:
+        db.exec(
+            update(users_table)
+            .where(users_table.c.id == user_id)
+            .values(
+                tasks_version=users_table.c.tasks_version + 1,
+                **{f"{s}_count": count for s, count in actual.items()},
+            )
+        )
+        db.commit()
+    else:
+        db.rollback()
+    return stored, actual
@@ -1,28 +1,261 @@
-from typing import Generator
-import os
+from typing import Any, AsyncGenerator, Callable, Dict, Generator, List, Optional, Union
+import threading
+import time
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine, Row, make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.sql import Executable
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
 from sqlmodel import create_engine, Session, SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.concurrency import run_in_threadpool
 
 # Make sure to import models to register them with SQLModel.metadata
 from models import User, Task
+import metrics
+import query_log
+from config import (
+    METRICS_ENABLED,
+    DATABASE_URL,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_PRE_PING,
+    DB_POOL_RECYCLE,
+    DB_POOL_TIMEOUT,
+)
 
-# No global engine or create_db_and_tables in this version
+# Process-wide engine registry, keyed by database URL. Each engine owns a
+# connection pool, so it must be built once and shared by every request.
+_engines: Dict[str, Engine] = {}
+_async_engines: Dict[str, AsyncEngine] = {}
+_engines_lock = threading.Lock()
 
-def get_session(engine_to_use = None) -> Generator[Session, None, None]:
-    if engine_to_use:
-        current_engine = engine_to_use
-    else:
-        # This branch is for production/development usage outside of tests
-        print("Attempting to connect to the database.")
-        DATABASE_URL = os.getenv("DATABASE_URL")
-        if not DATABASE_URL:
-            print("DATABASE_URL environment variable is NOT set.")
-            raise ValueError("DATABASE_URL environment variable not set for production/development.")
-        else:
-            print("DATABASE_URL environment variable is set.")
-            # Log a redacted version for verification, not the whole key
-            print(f"DATABASE_URL format check: {DATABASE_URL[:15]}...")
-
-        current_engine = create_engine(DATABASE_URL, echo=True)
+# Drivers used when DATABASE_ASYNC is enabled, by URL backend name.
+_ASYNC_DRIVERS = {"postgresql": "asyncpg", "postgres": "asyncpg", "sqlite": "aiosqlite"}
+
+# --- Pool metrics ---
+pool_checkout_duration = metrics.Histogram(
+    "db_pool_checkout_seconds",
+    "Time taken to get a connection from the pool, including waiting for one.",
+    ("engine",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+pool_checkout_timeouts = metrics.Counter(
+    "db_pool_checkout_timeouts_total",
+    "Checkouts that gave up after DB_POOL_TIMEOUT seconds.",
+    ("engine",),
+)
+connection_hold_duration = metrics.Histogram(
+    "db_connection_hold_seconds",
+    "Time a connection stayed checked out of the pool.",
+    ("engine",),
+)
+
+
+class _TimedCheckout:
+    engine_label = "sync"
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            pool_checkout_timeouts.inc(self.engine_label)
+            raise
+        finally:
+            pool_checkout_duration.observe(time.perf_counter() - started, self.engine_label)
+
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    """
+    QueuePool that records how long each checkout took (METRICS_ENABLED).
+    """
+
+
+class TimedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    """
+    AsyncAdaptedQueuePool that records how long each checkout took (METRICS_ENABLED).
+    """
+
+    engine_label = "async"
+
+
+def _instrument_pool(engine: Engine, label: str) -> None:
+    if not METRICS_ENABLED:
+        return
+
+    @event.listens_for(engine, "checkout")
+    def _checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info["checked_out_at"] = time.perf_counter()
+
+    @event.listens_for(engine, "checkin")
+    def _checkin(dbapi_connection, connection_record):
+        checked_out_at = connection_record.info.pop("checked_out_at", None)
+        if checked_out_at is not None:
+            connection_hold_duration.observe(time.perf_counter() - checked_out_at, label)
+
+
+def _pool_samples():
+    pools = [("sync", engine.pool) for engine in list(_engines.values())]
+    pools += [("async", engine.sync_engine.pool) for engine in list(_async_engines.values())]
+    for label, pool in pools:
+        if not isinstance(pool, QueuePool):
+            continue
+        labels = {"engine": label}
+        yield "db_pool_size", "gauge", "Connections the pool keeps open.", labels, pool.size()
+        yield "db_pool_checked_out", "gauge", "Connections currently in use.", labels, pool.checkedout()
+        yield "db_pool_checked_in", "gauge", "Idle connections in the pool.", labels, pool.checkedin()
+        yield "db_pool_overflow", "gauge", "Connections open beyond the pool size.", labels, max(pool.overflow(), 0)
+
+
+metrics.REGISTRY.register_collector(_pool_samples)
+
+
+def _engine_options(url: str) -> dict:
+    """
+    Returns the create_engine() keyword arguments for the given URL.
+    """
+    if url.startswith("sqlite"):
+        # SQLite picks its own pool class; the sizing options do not apply.
+        return {"connect_args": {"check_same_thread": False}}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        **({"poolclass": TimedQueuePool} if METRICS_ENABLED else {}),
+    }
+
+
+def _async_url_and_options(url: str) -> tuple:
+    """
+    Rewrites a sync database URL for its async driver and returns it together
+    with the create_async_engine() keyword arguments.
+    """
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in _ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for '{backend}' databases.")
+    parsed = parsed.set(drivername=f"{'postgresql' if backend == 'postgres' else backend}+{_ASYNC_DRIVERS[backend]}")
 
+    options = _engine_options(url)
+    if backend != "sqlite":
+        # asyncpg does not understand libpq's query parameters; it takes the
+        # SSL mode as a connect argument instead.
+        query = dict(parsed.query)
+        sslmode = query.pop("sslmode", None)
+        query.pop("channel_binding", None)
+        parsed = parsed.set(query=query)
+        if sslmode:
+            options["connect_args"] = {"ssl": sslmode}
+        if METRICS_ENABLED:
+            options["poolclass"] = TimedAsyncQueuePool
+    return parsed.render_as_string(hide_password=False), options
+
+
+def get_engine(url: Optional[str] = None) -> Engine:
+    """
+    Returns the shared engine for the given URL (DATABASE_URL by default),
+    creating it on first use.
+    """
+    url = url or DATABASE_URL
+    if not url:
+        raise ValueError("DATABASE_URL environment variable not set for production/development.")
+
+    engine = _engines.get(url)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.get(url)
+            if engine is None:
+                engine = create_engine(url, **_engine_options(url))
+                query_log.instrument(engine)
+                _instrument_pool(engine, "sync")
+                _engines[url] = engine
+    return engine
+
+
+def get_async_engine(url: Optional[str] = None) -> AsyncEngine:
+    """
+    Returns the shared async engine for the given URL (DATABASE_URL by default),
+    creating it on first use.
+    """
+    url = url or DATABASE_URL
+    if not url:
+        raise ValueError("DATABASE_URL environment variable not set for production/development.")
+
+    engine = _async_engines.get(url)
+    if engine is None:
+        with _engines_lock:
+            engine = _async_engines.get(url)
+            if engine is None:
+                async_url, options = _async_url_and_options(url)
+                engine = create_async_engine(async_url, **options)
+                query_log.instrument(engine.sync_engine)
+                _instrument_pool(engine.sync_engine, "async")
+                _async_engines[url] = engine
+    return engine
+
+
+def dispose_engines() -> None:
+    """
+    Closes every pooled connection and empties the registry.
+    """
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+
+
+async def dispose_async_engines() -> None:
+    """
+    Closes every pooled async connection and empties the async registry.
+    """
+    with _engines_lock:
+        engines = list(_async_engines.values())
+        _async_engines.clear()
+    for engine in engines:
+        await engine.dispose()
+
+
+def get_session(engine_to_use = None) -> Generator[Session, None, None]:
+    current_engine = engine_to_use or get_engine()
     with Session(current_engine) as session:
-        yield session
\ No newline at end of file
+        yield session
+
+
+async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
+    # expire_on_commit=False: attributes of committed objects must stay loaded,
+    # since lazy loads cannot happen outside the session's greenlet.
+    async with AsyncSession(get_async_engine(), expire_on_commit=False) as session:
+        yield session
+
+
+async def run_in_session(db: Union[Session, AsyncSession], fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Calls ``fn(sync_session, *args, **kwargs)`` without blocking the event loop.
+
+    A regular ``Session`` is handed to the threadpool; an ``AsyncSession`` runs
+    ``fn`` through ``run_sync``, so its I/O is awaited natively on the loop.
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args, **kwargs)
+    return await run_in_threadpool(fn, db, *args, **kwargs)
+
+
+async def stream_in_session(db: Union[Session, AsyncSession], statement: Executable, batch_size: int) -> AsyncGenerator[List[Row], None]:
+    """
+    Yields the rows of ``statement`` in batches of ``batch_size`` through a
+    server-side cursor, so memory stays bounded by one batch.
+    """
+    statement = statement.execution_options(yield_per=batch_size)
+    if isinstance(db, AsyncSession):
+        result = await db.stream(statement)
+        async for batch in result.partitions():
+            yield batch
+        return
+
+    result = await run_in_threadpool(db.exec, statement)
+    partitions = result.partitions()
+    while batch := await run_in_threadpool(next, partitions, None):
+        yield batch
@@ -0,0 +1,123 @@
+"""
+Incremental parsing of uploaded task files for POST /api/tasks/import.
+
+The request body is consumed chunk by chunk and turned into records one
+line at a time, so memory is bounded by the record size limit rather than
+by the size of the upload.
+"""
+from typing import AsyncIterator, Tuple, Union
+import csv
+import json
+
+
+class RecordError(ValueError):
+    """
+    A line that could not be parsed into a record at all.
+    """
+
+
+async def iter_lines(chunks: AsyncIterator[bytes], max_line_bytes: int) -> AsyncIterator[Union[str, RecordError]]:
+    """
+    Yields the lines of a UTF-8 body. A line longer than ``max_line_bytes``
+    yields a RecordError instead, and its bytes are dropped as they arrive.
+    """
+    pending = b""
+    too_long = False
+    first = True
+    async for chunk in chunks:
+        *lines, rest = chunk.split(b"\n")
+        for line in lines:
+            if too_long or len(pending) + len(line) > max_line_bytes:
+                yield RecordError(f"Line is longer than {max_line_bytes} bytes")
+            else:
+                yield _decode_line(pending + line, first)
+            pending, too_long, first = b"", False, False
+        if not too_long:
+            pending += rest
+            if len(pending) > max_line_bytes:
+                # Drop the line's bytes as they arrive; it is reported when it ends.
+                pending, too_long = b"", True
+    if too_long:
+        yield RecordError(f"Line is longer than {max_line_bytes} bytes")
+    elif pending:
+        yield _decode_line(pending, first)
+
+
+def _decode_line(data: bytes, first: bool) -> str:
+    # A newline byte never occurs inside a multi-byte UTF-8 sequence, so every
+    # line decodes on its own.
+    line = data.decode("utf-8").rstrip("\r")
+    return line[1:] if first and line.startswith("\ufeff") else line
+
+
+async def parse_ndjson(lines: AsyncIterator[Union[str, RecordError]]) -> AsyncIterator[Tuple[int, Union[dict, RecordError]]]:
+    """
+    Yields ``(line_number, record)`` for each non-blank line, where a line
+    that is not a JSON object yields a RecordError instead.
+    """
+    line_number = 0
+    async for line in lines:
+        line_number += 1
+        if isinstance(line, RecordError):
+            yield line_number, line
+            continue
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            yield line_number, RecordError(f"Invalid JSON: {exc}")
+            continue
+        if not isinstance(record, dict):
+            yield line_number, RecordError("Expected a JSON object")
+            continue
+        yield line_number, record
+
+
+async def parse_csv(lines: AsyncIterator[Union[str, RecordError]], max_record_bytes: int) -> AsyncIterator[Tuple[int, Union[dict, RecordError]]]:
+    """
+    Yields ``(line_number, record)`` for each CSV row after the header row.
+    Empty cells are left out, so the model's defaults apply to them. A row
+    longer than ``max_record_bytes`` yields a RecordError.
+    """
+    header = None
+    parts, size, start, line_number = [], 0, 0, 0
+    # Whether the row so far ends inside a quoted field, and whether it is
+    # being skipped (too long, or holds a line that was too long).
+    quoted, error = False, None
+    async for line in lines:
+        line_number += 1
+        if not quoted:
+            parts, size, start, error = [], 0, line_number, None
+        if isinstance(line, RecordError):
+            # The line's quotes are unknown; end the row here.
+            quoted, error = False, error or line
+        else:
+            quoted ^= line.count('"') % 2 == 1
+            if error is None:
+                size += len(line.encode("utf-8")) + 1
+                if size > max_record_bytes:
+                    error, parts = RecordError(f"Row is longer than {max_record_bytes} bytes"), []
+                else:
+                    parts.append(line)
+        if quoted:
+            # A quoted field continues on the next line
+            continue
+        if error is not None:
+            yield start, error
+            continue
+        record = "\n".join(parts)
+        if not record.strip():
+            continue
+
+        values = next(csv.reader([record]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        if len(values) > len(header):
+            yield start, RecordError(f"Expected {len(header)} fields, got {len(values)}")
+            continue
+        yield start, {name: value for name, value in zip(header, values) if value != ""}
+
+    if quoted:
+        yield start, error or RecordError("Unterminated quoted field")
@@ -0,0 +1,453 @@
+"""
+Prometheus metrics, served as text by GET /metrics.
+
+Recording is lock-free: every thread updates its own copy of each metric
+(registered once, on the thread's first update), and the copies are summed when
+the metrics are read. When a thread exits, its copy is folded into the
+metric's retired total, so worker churn does not accumulate copies. Values
+owned by other modules (pools, caches, the hashing executor) are read from
+their ``stats()`` at scrape time instead.
+
+Each worker process has its own values. With METRICS_MULTIPROC_DIR set, every
+process writes a snapshot to ``<dir>/<pid>.json`` every METRICS_FLUSH_INTERVAL
+seconds (and at shutdown), and a scrape of any worker reports the sum over all
+snapshots. Counters and histograms of exited processes are kept, so totals
+never go backwards; their gauges are dropped.
+"""
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+import glob
+import json
+import math
+import os
+import threading
+import time
+import weakref
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+import auth
+import cache
+import security
+import serialization
+import singleflight
+from config import METRICS_ENABLED, METRICS_MULTIPROC_DIR, METRICS_FLUSH_INTERVAL
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+# A family is {"type", "help", "samples": {labels: value}}, plus "buckets" for
+# histograms. Labels are a tuple of (name, value) pairs; a histogram value is
+# its per-bucket counts (the last one is +Inf) followed by the sum.
+Labels = Tuple[Tuple[str, str], ...]
+Families = Dict[str, dict]
+
+
+class _Shard:
+    # Held only by the owning thread's thread-local storage; collected, and
+    # finalized, when that thread exits.
+    __slots__ = ("values", "__weakref__")
+
+    def __init__(self):
+        self.values: dict = {}
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), registry: Optional["Registry"] = None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: Dict[int, dict] = {}
+        self._retired: dict = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _shard(self) -> dict:
+        try:
+            return self._local.shard.values
+        except AttributeError:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._shards[id(shard.values)] = shard.values
+            weakref.finalize(shard, self._retire, shard.values)
+            return shard.values
+
+    def _retire(self, values: dict) -> None:
+        with self._lock:
+            del self._shards[id(values)]
+            retired = self._retired
+            for labels, value in values.items():
+                retired[labels] = self._merge(retired[labels], value) if labels in retired else self._copy(value)
+
+    def _merge(self, total, value):
+        return total + value
+
+    def _copy(self, value):
+        return value
+
+    def samples(self) -> Dict[Labels, object]:
+        with self._lock:
+            shards = [self._retired.copy(), *self._shards.values()]
+        totals: Dict[Labels, object] = {}
+        for shard in shards:
+            # dict.copy() runs without releasing the GIL, so it cannot see a
+            # half-applied update from the owning thread.
+            for labels, value in shard.copy().items():
+                key = tuple(zip(self.labelnames, labels))
+                totals[key] = self._merge(totals[key], value) if key in totals else self._copy(value)
+        return totals
+
+    def family(self) -> dict:
+        return {"type": self.kind, "help": self.help, "samples": self.samples()}
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+
+class Gauge(Counter):
+    """
+    A value that goes up and down. Only ``inc``/``dec`` are supported, so the
+    per-thread copies can be summed.
+    """
+
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Optional["Registry"] = None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames, registry)
+
+    def observe(self, value: float, *labels: str) -> None:
+        shard = self._shard()
+        counts = shard.get(labels)
+        if counts is None:
+            counts = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def _merge(self, total, value):
+        return [a + b for a, b in zip(total, value)]
+
+    def _copy(self, value):
+        return list(value)
+
+    def family(self) -> dict:
+        return {**super().family(), "buckets": list(self.buckets)}
+
+
+# A collector returns (name, type, help, labels, value) samples read at scrape time.
+Collector = Callable[[], Iterable[Tuple[str, str, str, Dict[str, str], float]]]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Collector] = []
+
+    def register(self, metric: _Metric) -> None:
+        self._metrics.append(metric)
+
+    def register_collector(self, collector: Collector) -> None:
+        self._collectors.append(collector)
+
+    def collect(self) -> Families:
+        """
+        Returns the current values of this process.
+        """
+        families = {metric.name: metric.family() for metric in self._metrics}
+        for collector in self._collectors:
+            for name, kind, help, labels, value in collector():
+                family = families.setdefault(name, {"type": kind, "help": help, "samples": {}})
+                family["samples"][tuple(labels.items())] = value
+        return families
+
+
+REGISTRY = Registry()
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds",
+    "Time from receiving a request to sending the last byte of its response.",
+    ("method", "route", "status"),
+)
+http_requests_in_flight = Gauge(
+    "http_requests_in_flight",
+    "Requests received whose response has not been sent yet.",
+    ("method",),
+)
+
+
+# --- Multiprocess aggregation ---
+
+def _snapshot_path(directory: str, pid: int) -> str:
+    return os.path.join(directory, f"{pid}.json")
+
+
+def write_snapshot(directory: str, families: Families, final: bool = False) -> None:
+    """
+    Writes this process's values to its snapshot file. The final snapshot,
+    written at shutdown, leaves out gauges.
+    """
+    data = {
+        name: {**family, "samples": [[list(labels), value] for labels, value in family["samples"].items()]}
+        for name, family in families.items()
+        if not (final and family["type"] == "gauge")
+    }
+    path = _snapshot_path(directory, os.getpid())
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as f:
+        json.dump(data, f)
+    # Readers see either the previous snapshot or this one, never a partial file.
+    os.replace(temporary, path)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def read_snapshots(directory: str) -> Families:
+    """
+    Sums the snapshots of every process. Gauges only count for running processes.
+    """
+    families: Families = {}
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        try:
+            pid = int(os.path.basename(path)[:-len(".json")])
+            with open(path) as f:
+                data = json.load(f)
+        except (ValueError, OSError):
+            continue
+        alive = _pid_alive(pid)
+        for name, family in data.items():
+            if family["type"] == "gauge" and not alive:
+                continue
+            total = families.setdefault(name, {**family, "samples": {}})
+            samples = total["samples"]
+            for labels, value in family["samples"]:
+                labels = tuple(tuple(pair) for pair in labels)
+                if labels not in samples:
+                    samples[labels] = value
+                elif isinstance(value, list):
+                    samples[labels] = [a + b for a, b in zip(samples[labels], value)]
+                else:
+                    samples[labels] += value
+    return families
+
+
+_flusher: Optional[threading.Thread] = None
+_stopping = threading.Event()
+
+
+def _flush_loop() -> None:
+    while not _stopping.wait(METRICS_FLUSH_INTERVAL):
+        try:
+            write_snapshot(METRICS_MULTIPROC_DIR, REGISTRY.collect())
+        except OSError:
+            pass
+
+
+def start() -> None:
+    """
+    Starts writing this process's snapshots when METRICS_MULTIPROC_DIR is set.
+    """
+    global _flusher
+    if not METRICS_ENABLED or not METRICS_MULTIPROC_DIR or _flusher is not None:
+        return
+    os.makedirs(METRICS_MULTIPROC_DIR, exist_ok=True)
+    _stopping.clear()
+    _flusher = threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True)
+    _flusher.start()
+
+
+def stop() -> None:
+    """
+    Stops the snapshot thread and writes the final snapshot.
+    """
+    global _flusher
+    if _flusher is None:
+        return
+    _stopping.set()
+    _flusher.join()
+    _flusher = None
+    write_snapshot(METRICS_MULTIPROC_DIR, REGISTRY.collect(), final=True)
+
+
+# --- Exposition ---
+
+def _add_hit_ratios(families: Families) -> None:
+    hits = families.get("cache_hits_total", {}).get("samples", {})
+    misses = families.get("cache_misses_total", {}).get("samples", {})
+    ratios = {}
+    for labels, hit_count in hits.items():
+        lookups = hit_count + misses.get(labels, 0)
+        ratios[labels] = hit_count / lookups if lookups else 0.0
+    if ratios:
+        families["cache_hit_ratio"] = {"type": "gauge", "help": "Fraction of cache lookups that were hits.", "samples": ratios}
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def format_families(families: Families) -> str:
+    lines = []
+    for name in sorted(families):
+        family = families[name]
+        lines.append(f"# HELP {name} {_escape(family['help'])}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        for labels, value in sorted(family["samples"].items()):
+            if family["type"] != "histogram":
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(family["buckets"]) + [math.inf], value[:-1]):
+                cumulative += count
+                bucket_labels = labels + (("le", _format_value(bound)),)
+                lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value[-1])}")
+            lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def render() -> str:
+    """
+    Returns every metric in the Prometheus text format, summed over all worker
+    processes when METRICS_MULTIPROC_DIR is set.
+    """
+    families = REGISTRY.collect()
+    if METRICS_MULTIPROC_DIR:
+        os.makedirs(METRICS_MULTIPROC_DIR, exist_ok=True)
+        write_snapshot(METRICS_MULTIPROC_DIR, families)
+        families = read_snapshots(METRICS_MULTIPROC_DIR)
+    _add_hit_ratios(families)
+    return format_families(families)
+
+
+# --- Collectors for state owned by other modules ---
+
+def _runtime_samples():
+    hashing = security.hash_executor_stats()
+    yield "password_hash_workers", "gauge", "Threads or processes hashing passwords.", {}, hashing["workers"]
+    yield "password_hash_queue_limit", "gauge", "Hashing jobs accepted before requests are rejected with 503.", {}, hashing["queue_limit"]
+    yield "password_hash_in_flight", "gauge", "Hashing jobs queued or running.", {}, hashing["in_flight"]
+    yield "password_hash_queue_depth", "gauge", "Hashing jobs waiting for a worker.", {}, max(hashing["in_flight"] - hashing["workers"], 0)
+    yield "password_hash_jobs_total", "counter", "Hashing jobs completed.", {}, hashing["completed"]
+    yield "password_hash_rejected_total", "counter", "Hashing jobs rejected because the queue was full.", {}, hashing["rejected"]
+    yield "password_hash_queue_wait_seconds_total", "counter", "Time hashing jobs spent waiting for a worker.", {}, hashing["queue_wait_seconds"]
+    yield "password_hash_seconds_total", "counter", "Time spent hashing passwords.", {}, hashing["hash_seconds"]
+
+    caches = [("verified_tokens", auth.verified_tokens.stats()), ("task_fragments", serialization.task_fragments.stats())]
+    if cache.task_lists is not None:
+        caches.append(("task_lists", cache.task_lists.stats()))
+    for name, stats in caches:
+        labels = {"cache": name}
+        yield "cache_hits_total", "counter", "Cache lookups that found an entry.", labels, stats["hits"]
+        yield "cache_misses_total", "counter", "Cache lookups that found no entry.", labels, stats["misses"]
+        if "evictions" in stats:
+            yield "cache_evictions_total", "counter", "Entries evicted to stay within the cache's bound.", labels, stats["evictions"]
+        if "entries" in stats or "size" in stats:
+            yield "cache_entries", "gauge", "Entries held by the cache.", labels, stats.get("entries", stats.get("size"))
+        if "bytes" in stats:
+            yield "cache_bytes", "gauge", "Bytes of cached values held in memory.", labels, stats["bytes"]
+            yield "cache_max_bytes", "gauge", "Byte budget the cache evicts entries to stay within.", labels, stats["max_bytes"]
+
+    flights = singleflight.reads.stats()
+    yield "coalesced_executions_total", "counter", "Reads executed on behalf of identical concurrent requests.", {}, flights["executions"]
+    yield "coalesced_requests_total", "counter", "Requests that waited for an identical read instead of running it.", {}, flights["coalesced"]
+
+
+REGISTRY.register_collector(_runtime_samples)
+
+
+# --- Middleware ---
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request latency by method, route template and
+    status code, and the number of requests in flight.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._route_paths: Dict[Callable, str] = {}
+
+    def route_path(self, scope: Scope) -> str:
+        # The router stores the matched endpoint in the scope; label by its
+        # path template so /api/tasks/1 and /api/tasks/2 share a series.
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "<unmatched>"
+        path = self._route_paths.get(endpoint)
+        if path is None:
+            self._route_paths = {
+                route.endpoint: route.path for route in scope["app"].routes if hasattr(route, "endpoint")
+            }
+            path = self._route_paths.get(endpoint, "<unmatched>")
+        return path
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        started = time.perf_counter()
+        status_code = 500
+        recorded = False
+        http_requests_in_flight.inc(method)
+
+        def record() -> None:
+            nonlocal recorded
+            if recorded:
+                return
+            recorded = True
+            http_requests_in_flight.dec(method)
+            http_request_duration.observe(time.perf_counter() - started, method, self.route_path(scope), str(status_code))
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                # Background tasks run after this; they are not part of the latency.
+                record()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            record()
@@ -1,7 +1,42 @@
 from typing import List, Optional
 from datetime import datetime, timezone
+from sqlalchemy import DateTime, Index, SmallInteger
+from sqlalchemy.types import TypeDecorator
 from sqlmodel import Field, Relationship, SQLModel
 
+
+class UTCDateTime(TypeDecorator):
+    """
+    TIMESTAMP (without time zone) holding UTC. Aware datetimes are converted to
+    naive UTC when bound: asyncpg rejects aware values for this column type.
+    """
+    impl = DateTime
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is not None and value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+
+# Task statuses in storage order: Task.status holds the index as a SMALLINT.
+TASK_STATUSES = ("pending", "in_progress", "completed")
+
+
+class TaskStatusType(TypeDecorator):
+    """
+    Stores a task status name as its position in TASK_STATUSES.
+    """
+    impl = SmallInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else TASK_STATUSES.index(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else TASK_STATUSES[value]
+
+
 class User(SQLModel, table=True):
     """
     Represents a user. This model is for reference within SQLModel for relationships.
@@ -12,7 +47,16 @@ class User(SQLModel, table=True):
     email: str = Field(unique=True, nullable=False)
     hashed_password: str = Field(nullable=False) # Added for local password verification
     name: Optional[str] = Field(default=None)
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), nullable=False)
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), nullable=False, sa_type=UTCDateTime)
+    # Bumped to revoke every access token issued to the user so far
+    token_version: int = Field(default=0, nullable=False, sa_column_kwargs={"server_default": "0"})
+    # Bumped by every write to the user's tasks; the task list ETag is derived from it
+    tasks_version: int = Field(default=0, nullable=False, sa_column_kwargs={"server_default": "0"})
+    # Number of the user's tasks in each status, adjusted by every task write
+    # in the same transaction; see crud.reconcile_task_counts for repairs
+    pending_count: int = Field(default=0, nullable=False, sa_column_kwargs={"server_default": "0"})
+    in_progress_count: int = Field(default=0, nullable=False, sa_column_kwargs={"server_default": "0"})
+    completed_count: int = Field(default=0, nullable=False, sa_column_kwargs={"server_default": "0"})
 
     tasks: List["Task"] = Relationship(back_populates="user")
 
@@ -23,13 +67,28 @@ class User(SQLModel, table=True):
         }
 
 class Task(SQLModel, table=True):
+    # Indexes follow the query shapes in crud.py. Every list query is an equality
+    # on user_id (and optionally status) followed by the (created_at, id) keyset
+    # order, so each one is a single index range scan with no sort step. Lookups
+    # by (id, user_id) go through the primary key.
+    __table_args__ = (
+        Index("ix_task_user_id_created_at_id", "user_id", "created_at", "id"),
+        Index("ix_task_user_id_status_created_at_id", "user_id", "status", "created_at", "id"),
+        # Delta sync: tasks changed since a watermark
+        Index("ix_task_user_id_updated_at", "user_id", "updated_at"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    user_id: str = Field(index=True, nullable=False, foreign_key="user.id")
+    user_id: str = Field(nullable=False, foreign_key="user.id")
     title: str = Field(max_length=200, nullable=False)
     description: Optional[str] = Field(default=None, max_length=1000)
+    status: str = Field(default="pending", nullable=False, sa_type=TaskStatusType, sa_column_kwargs={"server_default": "0"})
+    # Kept equal to status == "completed" for clients that only read the flag
     completed: bool = Field(default=False, nullable=False)
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), nullable=False)
-    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), nullable=False)
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), nullable=False, sa_type=UTCDateTime)
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), nullable=False, sa_type=UTCDateTime)
+    # Row version, incremented on every update; exposed as the task's ETag
+    version: int = Field(default=1, nullable=False, sa_column_kwargs={"server_default": "1"})
 
     user: User = Relationship(back_populates="tasks")
 
@@ -38,3 +97,18 @@ class Task(SQLModel, table=True):
         json_encoders = {
             datetime: lambda v: v.isoformat() if v else None
         }
+
+
+class TaskTombstone(SQLModel, table=True):
+    """
+    Deletion log for delta sync: one row per deleted task, so clients polling
+    for changes learn about deletions as well as updates.
+    """
+    __table_args__ = (
+        Index("ix_tasktombstone_user_id_deleted_at", "user_id", "deleted_at"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    task_id: int = Field(nullable=False)
+    user_id: str = Field(nullable=False, foreign_key="user.id")
+    deleted_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), nullable=False, sa_type=UTCDateTime)
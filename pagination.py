@@ -0,0 +1,56 @@
+"""
+Opaque cursors for keyset pagination over ``(created_at, id)``, and the
+watermark tokens handed out by the delta sync endpoint.
+"""
+from typing import Optional, Tuple
+from datetime import datetime, timezone
+import base64
+import json
+
+
+def encode_cursor(created_at: datetime, id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    Returns the ``(created_at, id)`` position encoded in a cursor.
+    Raises ValueError if the cursor is malformed.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(id)
+    except (TypeError, ValueError) as exc:
+        raise ValueError("Invalid cursor") from exc
+
+
+def encode_watermark(position: datetime, cursor: Optional[str] = None) -> str:
+    """
+    Encodes a delta sync position. During a paged initial sync the token also
+    carries the list cursor of the next page.
+    """
+    state = {"since": position.isoformat()}
+    if cursor is not None:
+        state["cursor"] = cursor
+    raw = json.dumps(state, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_watermark(token: str) -> Tuple[datetime, Optional[Tuple[datetime, int]]]:
+    """
+    Returns the position encoded in a watermark token, and the ``(created_at, id)``
+    position of the next initial sync page, if any.
+    Raises ValueError if the token is malformed.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        state = json.loads(raw)
+        since = datetime.fromisoformat(state["since"])
+        cursor = state.get("cursor")
+    except (TypeError, ValueError, KeyError, AttributeError) as exc:
+        raise ValueError("Invalid watermark") from exc
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return since, decode_cursor(cursor) if cursor is not None else None
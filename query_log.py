@@ -0,0 +1,132 @@
+"""
+Sampled, structured SQL logging.
+
+Replaces ``echo=True``: statements are timed through engine events, reduced to
+a fingerprint (literals and IN-lists stripped) and written as one JSON line per
+statement through a ``QueueHandler``, so request threads never block on stdout.
+"""
+from typing import Optional
+import hashlib
+import json
+import logging
+import queue
+import random
+import re
+import sys
+import time
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from config import SQL_LOG_ENABLED, SQL_LOG_SAMPLE_RATE, SQL_LOG_SLOW_MS
+
+logger = logging.getLogger("todo.sql")
+logger.propagate = False
+
+_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+_listener: Optional[QueueListener] = None
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|:\w+|\$\d+|\?|%s")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_VALUES_LIST = re.compile(r"(\(\?\))(?:\s*,\s*\(\?\))+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps({
+            "ts": round(record.created, 6),
+            "logger": record.name,
+            "level": record.levelname,
+            **getattr(record, "sql", {}),
+        })
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(statement: str) -> tuple:
+    """
+    Returns ``(fingerprint_id, normalized_statement)`` for a SQL string.
+
+    Statements that differ only in literal values, parameter names or the
+    length of IN / VALUES lists share a fingerprint.
+    """
+    normalized = _STRING_LITERAL.sub("?", statement)
+    normalized = _PLACEHOLDER.sub("?", normalized)
+    normalized = _NUMBER_LITERAL.sub("?", normalized)
+    normalized = _WHITESPACE.sub(" ", normalized).strip()
+    normalized = _PLACEHOLDER_LIST.sub("(?)", normalized)
+    normalized = _VALUES_LIST.sub(r"\1", normalized)
+    digest = hashlib.sha1(normalized.encode()).hexdigest()[:16]
+    return digest, normalized
+
+
+# The start time is kept on the statement's execution context rather than the
+# connection, so a statement that raises (and never reaches
+# after_cursor_execute) leaves nothing behind on the pooled connection.
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_log_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration_ms = (time.perf_counter() - context._query_log_start) * 1000
+    slow = duration_ms >= SQL_LOG_SLOW_MS
+    if not slow and random.random() >= SQL_LOG_SAMPLE_RATE:
+        return
+
+    fingerprint_id, normalized = fingerprint(statement)
+    logger.log(
+        logging.WARNING if slow else logging.INFO,
+        normalized,
+        extra={"sql": {
+            "fingerprint": fingerprint_id,
+            "statement": normalized,
+            "duration_ms": round(duration_ms, 3),
+            "rows": cursor.rowcount,
+            "executemany": executemany,
+            "slow": slow,
+        }},
+    )
+
+
+def instrument(engine: Engine) -> None:
+    """
+    Attaches the timing hooks to an engine. A no-op unless SQL_LOG_ENABLED is set.
+    """
+    if not SQL_LOG_ENABLED:
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def start() -> None:
+    """
+    Starts the background thread that drains the log queue to stdout.
+    """
+    global _listener
+    if not SQL_LOG_ENABLED or _listener is not None:
+        return
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JSONFormatter())
+    logger.addHandler(QueueHandler(_queue))
+    logger.setLevel(logging.INFO)
+    _listener = QueueListener(_queue, stream_handler)
+    _listener.start()
+
+
+def stop() -> None:
+    """
+    Flushes the queued records and stops the background thread.
+    """
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
+    for handler in list(logger.handlers):
+        if isinstance(handler, QueueHandler):
+            logger.removeHandler(handler)
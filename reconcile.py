@@ -0,0 +1,60 @@
+"""
+Recomputes the per-status task counts stored on each user from the task
+table and repairs any that have drifted.
+
+Usage (from the repository root):
+    python reconcile.py                 # every user
+    python reconcile.py --user-id ID    # one user
+    python reconcile.py --dry-run       # report drift without repairing it
+
+Safe to run while the API is serving: each user is recounted under a lock on
+their row (see crud.reconcile_task_counts).
+"""
+import argparse
+import asyncio
+import sys
+
+from sqlmodel import Session, select
+
+import cache
+import crud
+from database import get_engine
+from models import User
+
+
+async def invalidate_task_lists(user_ids) -> None:
+    # The repair bumped each user's tasks version, so their cached pages can no
+    # longer be hit; this frees them from a shared cache.
+    for user_id in user_ids:
+        await cache.task_lists.invalidate(user_id)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Recount tasks per status and repair drifted user counts.")
+    parser.add_argument("--user-id", help="Only reconcile this user")
+    parser.add_argument("--dry-run", action="store_true", help="Report drift without repairing it")
+    args = parser.parse_args()
+
+    engine = get_engine()
+    with Session(engine) as db:
+        user_ids = [args.user_id] if args.user_id else db.exec(select(User.id).order_by(User.id)).all()
+        db.rollback()
+
+        drifted = []
+        for user_id in user_ids:
+            result = crud.reconcile_task_counts(db, user_id, repair=not args.dry_run)
+            if result is not None:
+                drifted.append(user_id)
+                stored, actual = result
+                print(f"{user_id}: stored {stored}, actual {actual}")
+
+    if drifted and not args.dry_run and cache.task_lists is not None:
+        asyncio.run(invalidate_task_lists(drifted))
+
+    action = "found" if args.dry_run else "repaired"
+    print(f"{len(drifted)} of {len(user_ids)} users {action} with drifted counts")
+    return 1 if drifted and args.dry_run else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
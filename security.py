@@ -1,5 +1,15 @@
+from typing import Any, Callable, Optional
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+import asyncio
+import threading
+import time
+
+from fastapi import HTTPException, status
 from passlib.context import CryptContext
 
+import timing
+from config import HASH_EXECUTOR, HASH_WORKERS, HASH_QUEUE_LIMIT
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -17,3 +27,98 @@ def get_password_hash(password: str) -> str:
     # Truncate password to 72 characters to match bcrypt's limit
     truncated_password = password[:72]
     return pwd_context.hash(truncated_password)
+
+
+# --- Dedicated hashing executor ---
+# bcrypt jobs run on their own small pool so a burst of logins cannot occupy
+# the request threadpool. Jobs beyond HASH_QUEUE_LIMIT are rejected with 503.
+
+_executor: Optional[Executor] = None
+_lock = threading.Lock()
+_stats = {
+    "in_flight": 0,
+    "max_in_flight": 0,
+    "completed": 0,
+    "rejected": 0,
+    "queue_wait_seconds": 0.0,
+    "hash_seconds": 0.0,
+}
+
+
+def _get_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                if HASH_EXECUTOR == "process":
+                    _executor = ProcessPoolExecutor(max_workers=HASH_WORKERS)
+                else:
+                    _executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+    return _executor
+
+
+def _timed(fn: Callable[..., Any], *args) -> tuple:
+    # Runs in the worker; time.monotonic() is system-wide, so the timestamps
+    # are comparable with the submitting process.
+    started = time.monotonic()
+    result = fn(*args)
+    return result, started, time.monotonic()
+
+
+async def _run_hash_job(fn: Callable[..., Any], *args) -> Any:
+    with _lock:
+        if _stats["in_flight"] >= HASH_QUEUE_LIMIT:
+            _stats["rejected"] += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, please retry",
+                headers={"Retry-After": "1"},
+            )
+        _stats["in_flight"] += 1
+        _stats["max_in_flight"] = max(_stats["max_in_flight"], _stats["in_flight"])
+
+    submitted = time.monotonic()
+    try:
+        loop = asyncio.get_running_loop()
+        result, started, finished = await loop.run_in_executor(_get_executor(), _timed, fn, *args)
+    finally:
+        with _lock:
+            _stats["in_flight"] -= 1
+
+    with _lock:
+        _stats["completed"] += 1
+        _stats["queue_wait_seconds"] += max(started - submitted, 0.0)
+        _stats["hash_seconds"] += finished - started
+    timing.record("hash_queue", max(started - submitted, 0.0))
+    timing.record("hash", finished - started)
+    return result
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """
+    Verifies a password on the hashing executor without blocking the event loop.
+    """
+    return await _run_hash_job(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """
+    Hashes a password on the hashing executor without blocking the event loop.
+    """
+    return await _run_hash_job(get_password_hash, password)
+
+
+def hash_executor_stats() -> dict:
+    """
+    Returns queue depth, rejections, and cumulative queue-wait and hash times.
+    """
+    with _lock:
+        return {"workers": HASH_WORKERS, "queue_limit": HASH_QUEUE_LIMIT, **_stats}
+
+
+def shutdown_executor() -> None:
+    global _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
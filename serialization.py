@@ -0,0 +1,152 @@
+"""
+Fast JSON encoding for task and user responses.
+
+Rows read from our own database are already valid, so with FAST_JSON enabled
+the endpoints skip FastAPI's response_model validation and jsonable_encoder
+and encode straight to bytes with orjson. Each response shape has a
+precompiled field getter that works on ORM objects and on RETURNING rows.
+"""
+from collections import OrderedDict
+from typing import Any, Iterable, Optional, Sequence, Tuple
+from datetime import datetime
+from operator import attrgetter, itemgetter
+import json
+import threading
+
+from fastapi import Response
+
+import timing
+from config import TASK_FRAGMENT_CACHE_MAX_BYTES
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt
+    orjson = None
+
+TASK_FIELDS = ("id", "user_id", "title", "description", "status", "completed", "created_at", "updated_at", "version")
+USER_FIELDS = ("id", "email", "created_at")
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, default=_default, separators=(",", ":")).encode()
+
+
+class Encoder:
+    """
+    Turns ORM objects or row mappings into dicts with a fixed set of keys.
+    """
+
+    def __init__(self, fields: Sequence[str]):
+        self.fields = tuple(fields)
+        self._from_mapping = itemgetter(*self.fields)
+        self._from_object = attrgetter(*self.fields)
+
+    def to_dict(self, obj: Any) -> dict:
+        getter = self._from_mapping if isinstance(obj, dict) else self._from_object
+        return dict(zip(self.fields, getter(obj)))
+
+    def encode(self, obj: Any) -> bytes:
+        with timing.phase("serialize"):
+            return dumps(self.to_dict(obj))
+
+    def encode_many(self, objs: Iterable[Any]) -> bytes:
+        to_dict = self.to_dict
+        with timing.phase("serialize"):
+            return dumps([to_dict(obj) for obj in objs])
+
+
+task_encoder = Encoder(TASK_FIELDS)
+user_encoder = Encoder(USER_FIELDS)
+
+
+class FragmentCache:
+    """
+    LRU of encoded JSON objects bounded by ``max_bytes``, used to assemble
+    list responses by concatenation so only new or changed rows are encoded.
+
+    Entries are keyed by ``key_fields``, which must change whenever the
+    encoded row does. For tasks that is (id, version, created_at). Every
+    update bumps the version. created_at tells apart a new task that reuses
+    a deleted task's id, as SQLite can.
+    """
+
+    def __init__(self, encoder: Encoder, key_fields: Sequence[str], max_bytes: int):
+        self.encoder = encoder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+        self._key_from_mapping = itemgetter(*key_fields)
+        self._key_from_object = attrgetter(*key_fields)
+        self._entries: "OrderedDict[Tuple, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def encode_many(self, objs: Sequence[Any]) -> bytes:
+        if self.max_bytes <= 0:
+            return self.encoder.encode_many(objs)
+        if not objs:
+            return b"[]"
+        with timing.phase("serialize"):
+            return self._assemble(objs)
+
+    def _assemble(self, objs: Sequence[Any]) -> bytes:
+        to_dict = self.encoder.to_dict
+        key_of = self._key_from_mapping if isinstance(objs[0], dict) else self._key_from_object
+        entries = self._entries
+        fragments = []
+        hits = 0
+        with self._lock:
+            for obj in objs:
+                key = key_of(obj)
+                fragment = entries.get(key)
+                if fragment is not None:
+                    entries.move_to_end(key)
+                    hits += 1
+                else:
+                    fragment = dumps(to_dict(obj))
+                    entries[key] = fragment
+                    self.bytes += len(fragment)
+                fragments.append(fragment)
+            while self.bytes > self.max_bytes and entries:
+                _, evicted = entries.popitem(last=False)
+                self.bytes -= len(evicted)
+                self.evictions += 1
+            self.hits += hits
+            self.misses += len(fragments) - hits
+        return b"[" + b",".join(fragments) + b"]"
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+task_fragments = FragmentCache(task_encoder, ("id", "version", "created_at"), TASK_FRAGMENT_CACHE_MAX_BYTES)
+
+
+def json_response(content: bytes, response: Optional[Response] = None, status_code: int = 200) -> Response:
+    """
+    Wraps encoded JSON in a Response, keeping any headers already set on the
+    endpoint's injected ``response``.
+    """
+    headers = dict(response.headers) if response is not None else None
+    return Response(content=content, status_code=status_code, media_type="application/json", headers=headers)
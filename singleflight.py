@@ -0,0 +1,108 @@
+"""
+Request coalescing ("singleflight").
+
+Concurrent calls with the same key share one execution: the first caller runs
+the function, and callers arriving while it is in flight wait for its result
+(or exception) instead of running their own. Nothing is cached; the next call
+after completion runs again.
+
+``run`` is for coroutines on the event loop and runs plain functions in the
+threadpool. ``run_sync`` is for code that already runs in a worker thread.
+"""
+from typing import Any, Callable, Dict, Hashable, Optional
+import asyncio
+import inspect
+import threading
+
+from starlette.concurrency import run_in_threadpool
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self.executions = 0
+        self.coalesced = 0
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self._sync_calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    async def run(self, key: Hashable, fn: Callable, *args, **kwargs) -> Any:
+        # Futures belong to one event loop; keep flights from different loops apart.
+        key = (id(asyncio.get_running_loop()), key)
+        while True:
+            future = self._calls.get(key)
+            if future is None:
+                break
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The caller running the function was cancelled; run it here instead.
+                self.coalesced -= 1
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        self.executions += 1
+        try:
+            if inspect.iscoroutinefunction(fn):
+                result = await fn(*args, **kwargs)
+            else:
+                result = await run_in_threadpool(fn, *args, **kwargs)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as exc:
+            future.set_exception(exc)
+            future.exception()  # retrieved here, so an unshared failure is not logged again
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+
+    def run_sync(self, key: Hashable, fn: Callable, *args, **kwargs) -> Any:
+        with self._lock:
+            call = self._sync_calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._sync_calls[key] = _Call()
+                self.executions += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._sync_calls[key]
+            call.done.set()
+
+    def stats(self) -> dict:
+        return {
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._calls) + len(self._sync_calls),
+        }
+
+
+# Read paths shared by identical concurrent requests (REQUEST_COALESCING)
+reads = SingleFlight()
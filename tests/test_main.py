@@ -1,9 +1,12 @@
 from typing import Generator
 from datetime import datetime, timezone
 from uuid import uuid4
+import os
+import re
+import time
 
 from fastapi.testclient import TestClient
-from sqlmodel import create_engine, SQLModel, Session
+from sqlmodel import create_engine, SQLModel, Session, text
 from sqlalchemy.engine import Engine
 from sqlalchemy.pool import StaticPool
 import pytest
@@ -42,7 +45,13 @@ def test_db_session_fixture(test_engine: Engine): # Depend on the test_engine fi
 
 # Fixture to provide a TestClient for a fresh FastAPI app instance for each test
 @pytest.fixture(name="client")
-def client_fixture(test_db_session: Session):
+def client_fixture(request, test_db_session: Session, tmp_path, monkeypatch):
+    # Tests marked with both_session_modes run once more with DATABASE_ASYNC,
+    # where the endpoints use get_async_session (aiosqlite) on the event loop.
+    if getattr(request, "param", "sync") == "async":
+        yield from async_client(tmp_path, monkeypatch)
+        return
+
     # These imports must be local to avoid module-level import issues when pytest scans
     # the test file before fixtures are set up correctly.
     from backend.main import app # Absolute import
@@ -58,6 +67,29 @@ def client_fixture(test_db_session: Session):
     app.dependency_overrides.clear()
 
 
+def async_client(tmp_path, monkeypatch) -> Generator[TestClient, None, None]:
+    """
+    Yields a client for an app built with DATABASE_ASYNC, whose sessions come
+    from the real get_async_session over a SQLite file. The app's lifespan
+    disposes the async engine on exit.
+    """
+    import backend.database as database_module
+    import backend.main as main_module
+
+    url = f"sqlite:///{tmp_path / 'async.db'}"
+    engine = create_engine(url)
+    SQLModel.metadata.create_all(engine)
+    engine.dispose()
+    monkeypatch.setattr(database_module, "DATABASE_URL", url)
+    monkeypatch.setattr(main_module, "DATABASE_ASYNC", True)
+
+    with TestClient(main_module.create_app()) as client:
+        yield client
+
+
+both_session_modes = pytest.mark.parametrize("client", ["sync", "async"], indirect=True)
+
+
 # --- Tests ---
 
 def test_read_root(client: TestClient):
@@ -155,6 +187,7 @@ def authenticated_client_fixture(client: TestClient):
 
 # --- Task Tests ---
 
+@both_session_modes
 def test_create_task(authenticated_client: TestClient):
     """
     Test creating a task for an authenticated user.
@@ -201,6 +234,7 @@ def create_task_for_user(client: TestClient, title: str, description: str = None
     return response.json()
 
 
+@both_session_modes
 def test_list_tasks(authenticated_client: TestClient):
     """
     Test listing tasks for an authenticated user.
@@ -219,6 +253,7 @@ def test_list_tasks(authenticated_client: TestClient):
     assert any(t["title"] == "Task 3" for t in tasks)
 
 
+@both_session_modes
 def test_list_tasks_filtered_by_status(authenticated_client: TestClient):
     """
     Test listing tasks filtered by status.
@@ -228,22 +263,41 @@ def test_list_tasks_filtered_by_status(authenticated_client: TestClient):
     create_task_for_user(authenticated_client, "In Progress Task", status="in_progress")
 
     # Filter for completed tasks
-    response = authenticated_client.get("/api/tasks", params={"status": "completed"})
+    response = authenticated_client.get("/api/tasks", params={"status_filter": "completed"})
     assert response.status_code == 200
     tasks = response.json()
     assert len(tasks) == 1
     assert tasks[0]["title"] == "Completed Task"
+    assert tasks[0]["status"] == "completed"
     assert tasks[0]["completed"] == True
 
     # Filter for pending tasks
-    response = authenticated_client.get("/api/tasks", params={"status": "pending"})
+    response = authenticated_client.get("/api/tasks", params={"status_filter": "pending"})
+    assert response.status_code == 200
+    tasks = response.json()
+    assert len(tasks) == 1
+    assert tasks[0]["title"] == "Pending Task"
+    assert tasks[0]["completed"] == False
+
+    # Filter for in-progress tasks
+    response = authenticated_client.get("/api/tasks", params={"status_filter": "in_progress"})
     assert response.status_code == 200
     tasks = response.json()
-    assert len(tasks) == 2 # Expect 2 tasks (pending and in_progress)
-    assert any(t["title"] == "Pending Task" for t in tasks)
-    assert any(t["title"] == "In Progress Task" for t in tasks)
+    assert len(tasks) == 1
+    assert tasks[0]["title"] == "In Progress Task"
+    assert tasks[0]["status"] == "in_progress"
     assert tasks[0]["completed"] == False
 
+    # Moving a task between statuses
+    task_id = tasks[0]["id"]
+    response = authenticated_client.put(f"/api/tasks/{task_id}", json={"status": "completed"})
+    assert response.json()["status"] == "completed"
+    response = authenticated_client.patch("/api/tasks", json={"ids": [task_id], "status": "in_progress"})
+    assert response.json()["ids"] == [task_id]
+    response = authenticated_client.get("/api/tasks", params={"status_filter": "in_progress"})
+    assert [t["id"] for t in response.json()] == [task_id]
+    assert response.json()[0]["completed"] == False
+
 
 def test_list_tasks_sorted_by_created_at(authenticated_client: TestClient):
     """
@@ -273,6 +327,7 @@ def test_list_tasks_unauthenticated(client: TestClient):
     assert response.json() == {"detail": "Not authenticated"}
 
 
+@both_session_modes
 def test_get_single_task(authenticated_client: TestClient):
     """
     Test successful retrieval of a single task for an authenticated user.
@@ -288,6 +343,7 @@ def test_get_single_task(authenticated_client: TestClient):
     assert task["completed"] == False
 
 
+@both_session_modes
 def test_get_single_task_not_found(authenticated_client: TestClient):
     """
     Test retrieval of a non-existent task.
@@ -359,6 +415,7 @@ def test_get_single_task_unauthorized(authenticated_client: TestClient):
     assert response.json() == {"detail": "Task not found"}
 
 
+@both_session_modes
 def test_update_task_full(authenticated_client: TestClient):
     """
     Test successful full update of a task for an authenticated user.
@@ -381,6 +438,7 @@ def test_update_task_full(authenticated_client: TestClient):
     assert updated_task["updated_at"] != original_task["updated_at"] # updated_at should change
 
 
+@both_session_modes
 def test_update_task_partial(authenticated_client: TestClient):
     """
     Test successful partial update of a task for an authenticated user.
@@ -401,6 +459,7 @@ def test_update_task_partial(authenticated_client: TestClient):
     assert updated_task["updated_at"] != original_task["updated_at"]
 
 
+@both_session_modes
 def test_update_task_not_found(authenticated_client: TestClient):
     """
     Test updating a non-existent task.
@@ -469,4 +528,1360 @@ def test_update_task_unauthorized(authenticated_client: TestClient, test_db_sess
     updated_data = {"title": "Attempted unauthorized update"}
     response = client_for_user2.put(f"/api/tasks/{user1_task_id}", json=updated_data)
     assert response.status_code == 404 # Should be 404 Not Found as ownership is enforced
-    assert response.json() == {"detail": "Task not found"}
\ No newline at end of file
+    assert response.json() == {"detail": "Task not found"}
+
+# --- Auth Tests ---
+
+def test_logout_revokes_token(authenticated_client: TestClient):
+    """
+    Test that logging out bumps the token version and rejects the old token.
+    """
+    assert authenticated_client.get("/api/users/me").status_code == 200
+
+    response = authenticated_client.post("/api/logout")
+    assert response.status_code == 200
+
+    response = authenticated_client.get("/api/users/me")
+    assert response.status_code == 401
+    assert response.json() == {"detail": "Could not validate credentials"}
+
+
+def test_stateless_principal(authenticated_client: TestClient, test_engine: Engine, test_db_session: Session, monkeypatch):
+    """
+    Test that in stateless mode the current user is built from token claims,
+    with no user query once the token version is cached, and that revocation
+    still applies.
+    """
+    from sqlalchemy import event
+    import backend.main as main_module
+    from backend.auth import token_versions
+    from backend.crud import bump_token_version
+    monkeypatch.setattr(main_module, "AUTH_STATELESS", True)
+
+    user_queries = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if re.match(r"\s*SELECT\b.*\bFROM user\b", statement, re.S):
+            user_queries.append(statement)
+
+    event.listen(test_engine, "before_cursor_execute", capture)
+    try:
+        response = authenticated_client.get("/api/users/me")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["email"] == "authuser@example.com"
+        assert "id" in data and "created_at" in data
+        assert len(user_queries) == 1  # the token version, now cached
+
+        user_queries.clear()
+        assert authenticated_client.get("/api/users/me").status_code == 200
+        task = authenticated_client.post("/api/tasks", json={"title": "Stateless"}).json()
+        assert authenticated_client.get(f"/api/tasks/{task['id']}").status_code == 200
+        assert user_queries == []
+    finally:
+        event.remove(test_engine, "before_cursor_execute", capture)
+
+    # A version bumped elsewhere is seen once the cached entry is dropped.
+    bump_token_version(test_db_session, data["id"])
+    assert authenticated_client.get("/api/users/me").status_code == 200
+    token_versions.invalidate(data["id"])
+    assert authenticated_client.get("/api/users/me").status_code == 401
+
+    token = authenticated_client.post("/api/login", data={"username": "authuser@example.com", "password": "auth-password"}).json()["access_token"]
+    authenticated_client.headers["Authorization"] = f"Bearer {token}"
+    assert authenticated_client.get("/api/users/me").status_code == 200
+    assert authenticated_client.post("/api/logout").status_code == 200
+    assert authenticated_client.get("/api/users/me").status_code == 401
+
+
+def test_verified_token_cache():
+    """
+    Test that verified tokens are served from the cache until they expire and
+    that the cache stays within its size bound.
+    """
+    from backend.auth import VerifiedTokenCache, create_access_token, verify_token, verified_tokens
+
+    token = create_access_token(data={"sub": "cache-user"})
+    hits = verified_tokens.hits
+    first = verify_token(token)
+    second = verify_token(token)
+    assert first == second
+    assert verified_tokens.hits == hits + 1
+
+    cache = VerifiedTokenCache(maxsize=2)
+    cache.set(b"a", {"sub": "a"}, time.time() + 60)
+    cache.set(b"b", {"sub": "b"}, time.time() - 1)  # already expired
+    assert cache.get(b"b") is None
+    cache.set(b"c", {"sub": "c"}, time.time() + 60)
+    cache.set(b"d", {"sub": "d"}, time.time() + 60)
+    assert cache.get(b"a") is None  # least recently used, evicted
+    assert cache.get(b"d") == {"sub": "d"}
+    stats = cache.stats()
+    assert stats["size"] == 2
+    assert stats["evictions"] == 1
+    assert stats["expirations"] == 1
+
+
+def test_token_version_cache_is_bounded():
+    """
+    Test that the token version cache prunes expired entries on insert and
+    keeps at most maxsize users.
+    """
+    from backend.auth import TokenVersionCache
+
+    cache = TokenVersionCache(ttl=0.05, maxsize=100)
+    for i in range(10):
+        cache.set(f"old-{i}", 1)
+    time.sleep(0.06)
+    cache.set("new", 2)
+    assert len(cache._entries) == 1
+    assert cache.get("old-0") is None
+    assert cache.get("new") == 2
+
+    cache = TokenVersionCache(ttl=60, maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 1)
+    cache.set("a", 2)  # refreshed, so "b" is now the oldest
+    cache.set("c", 1)
+    assert len(cache._entries) == 2
+    assert cache.get("b") is None
+    assert cache.get("a") == 2
+
+
+def test_register_rejected_when_hash_queue_full(client: TestClient, monkeypatch):
+    """
+    Test that registration fails fast with 503 when the hashing queue is full.
+    """
+    import backend.security as security_module
+    monkeypatch.setattr(security_module, "HASH_QUEUE_LIMIT", 0)
+
+    response = client.post(
+        "/api/register",
+        json={"email": "busy@example.com", "password": "strong-password"},
+    )
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert security_module.hash_executor_stats()["rejected"] >= 1
+
+
+@both_session_modes
+def test_list_tasks_paginated(authenticated_client: TestClient):
+    """
+    Test walking the task list page by page with the next-page cursor.
+    """
+    for i in range(5):
+        create_task_for_user(authenticated_client, f"Paged Task {i}")
+
+    titles = []
+    params = {"limit": 2}
+    while True:
+        response = authenticated_client.get("/api/tasks", params=params)
+        assert response.status_code == 200
+        page = response.json()
+        assert len(page) <= 2
+        titles.extend(t["title"] for t in page)
+        next_cursor = response.headers.get("X-Next-Cursor")
+        if not next_cursor:
+            break
+        assert 'rel="next"' in response.headers["Link"]
+        params = {"limit": 2, "cursor": next_cursor}
+
+    assert titles == [f"Paged Task {i}" for i in range(5)]
+
+    response = authenticated_client.get("/api/tasks", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid cursor"}
+
+
+def test_task_queries_use_indexes(authenticated_client: TestClient, test_engine: Engine, test_db_session: Session):
+    """
+    Test that every task endpoint's query is an index search, not a table scan
+    or a sort, on a large seeded table.
+    """
+    from sqlalchemy import event
+    from backend.models import TASK_STATUSES
+    from backend.pagination import encode_watermark
+
+    user_id = authenticated_client.get("/api/users/me").json()["id"]
+    other_user_id = str(uuid4())
+    test_db_session.add(User(id=other_user_id, email="bulk@example.com", hashed_password="x"))
+    now = datetime.now(timezone.utc)
+    test_db_session.bulk_insert_mappings(Task, [
+        {
+            "user_id": user_id if i % 10 == 0 else other_user_id,
+            "title": f"Seeded {i}",
+            "status": TASK_STATUSES[i % 3],
+            "completed": i % 3 == 2,
+            "created_at": now,
+            "updated_at": now,
+        }
+        for i in range(20000)
+    ])
+    test_db_session.commit()
+    test_db_session.exec(text("ANALYZE"))
+
+    task_id = create_task_for_user(authenticated_client, "Indexed Task")["id"]
+
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT") and "FROM task" in statement:
+            statements.append((statement, parameters))
+
+    event.listen(test_engine, "before_cursor_execute", capture)
+    try:
+        first_page = authenticated_client.get("/api/tasks", params={"limit": 50})
+        authenticated_client.get("/api/tasks", params={"limit": 50, "cursor": first_page.headers["X-Next-Cursor"]})
+        authenticated_client.get("/api/tasks", params={"status_filter": "completed"})
+        authenticated_client.get("/api/tasks", params={"status_filter": "pending"})
+        authenticated_client.get("/api/tasks", params={"status_filter": "in_progress"})
+        authenticated_client.get(f"/api/tasks/{task_id}")
+        authenticated_client.put(f"/api/tasks/{task_id}", json={"title": "Still Indexed"})
+        authenticated_client.delete(f"/api/tasks/{task_id}")
+        authenticated_client.get("/api/tasks/changes", params={"since": encode_watermark(now)})
+    finally:
+        event.remove(test_engine, "before_cursor_execute", capture)
+
+    assert statements
+    with test_engine.connect() as conn:
+        for statement, parameters in statements:
+            plan = [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+            assert not any(step.startswith("SCAN task") for step in plan), (statement, plan)
+            assert not any("TEMP B-TREE" in step for step in plan), (statement, plan)
+
+
+def test_task_writes_take_one_statement(authenticated_client: TestClient, test_engine: Engine):
+    """
+    Test that create, update and delete each reach the task table with a
+    single statement, and that a write request issues nothing beyond the
+    current-user load and the user's version bump.
+    """
+    from sqlalchemy import event
+
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        table = re.search(r"\b(?:from|into|update)\s+(\w+)", statement.lower())
+        statements.append((statement.split()[0], table.group(1) if table else None))
+
+    load_user = ("SELECT", "user")
+    bump_version = ("UPDATE", "user")
+    event.listen(test_engine, "before_cursor_execute", capture)
+    try:
+        task = create_task_for_user(authenticated_client, "Single Round Trip")
+        assert statements == [load_user, ("INSERT", "task"), bump_version]
+
+        statements.clear()
+        response = authenticated_client.put(f"/api/tasks/{task['id']}", json={"title": "Still One Trip"})
+        assert response.status_code == 200
+        assert response.json()["title"] == "Still One Trip"
+        assert statements == [load_user, ("UPDATE", "task"), bump_version]
+
+        # A status change also needs the status it replaces, for the task
+        # counts. PostgreSQL reads it in the same UPDATE; SQLite reads it first.
+        statements.clear()
+        response = authenticated_client.put(f"/api/tasks/{task['id']}", json={"status": "completed"})
+        assert response.status_code == 200
+        assert response.json()["completed"] == True
+        assert statements == [load_user, ("SELECT", "task"), ("UPDATE", "task"), bump_version]
+
+        # The deletion is recorded for delta sync, and the user's expired
+        # tombstones are pruned in the same transaction.
+        statements.clear()
+        response = authenticated_client.delete(f"/api/tasks/{task['id']}")
+        assert response.json() == {"message": "Task deleted successfully"}
+        assert statements == [
+            load_user, ("DELETE", "task"), ("DELETE", "tasktombstone"), ("INSERT", "tasktombstone"), bump_version
+        ]
+
+        statements.clear()
+        response = authenticated_client.delete(f"/api/tasks/{task['id']}")
+        assert response.status_code == 404
+        assert statements == [load_user, ("DELETE", "task")]
+    finally:
+        event.remove(test_engine, "before_cursor_execute", capture)
+
+
+@both_session_modes
+def test_create_tasks_bulk(authenticated_client: TestClient):
+    """
+    Test creating several tasks in one request, with and without partial mode.
+    """
+    items = [
+        {"title": "Bulk 1"},
+        {"title": "Bulk 2", "status": "completed"},
+        {"title": ""},  # invalid: empty title
+        {"title": "Bulk 4", "description": "Fourth"},
+    ]
+
+    response = authenticated_client.post("/api/tasks/bulk", json=items)
+    assert response.status_code == 422
+    assert [error["index"] for error in response.json()["detail"]] == [2]
+    assert authenticated_client.get("/api/tasks").json() == []
+
+    response = authenticated_client.post("/api/tasks/bulk", params={"partial": True}, json=items)
+    assert response.status_code == 201
+    data = response.json()
+    assert [t["title"] for t in data["created"]] == ["Bulk 1", "Bulk 2", "Bulk 4"]
+    assert [t["completed"] for t in data["created"]] == [False, True, False]
+    assert data["errors"][0]["index"] == 2
+    assert data["errors"][0]["errors"][0]["loc"] == ["title"]
+
+    tasks = authenticated_client.get("/api/tasks").json()
+    assert [t["title"] for t in tasks] == ["Bulk 1", "Bulk 2", "Bulk 4"]
+
+
+@both_session_modes
+def test_bulk_update_and_delete_tasks(authenticated_client: TestClient):
+    """
+    Test completing and clearing tasks with the set-based endpoints.
+    """
+    first = create_task_for_user(authenticated_client, "Bulk Change 1")
+    second = create_task_for_user(authenticated_client, "Bulk Change 2")
+    third = create_task_for_user(authenticated_client, "Bulk Change 3")
+
+    response = authenticated_client.patch("/api/tasks", json={"status": "completed"})
+    assert response.status_code == 400
+
+    response = authenticated_client.patch(
+        "/api/tasks", json={"ids": [first["id"], second["id"]], "status": "completed"}
+    )
+    assert response.status_code == 200
+    assert response.json()["affected"] == 2
+    assert sorted(response.json()["ids"]) == [first["id"], second["id"]]
+
+    response = authenticated_client.delete("/api/tasks", params={"status_filter": "completed"})
+    assert response.status_code == 200
+    assert sorted(response.json()["ids"]) == [first["id"], second["id"]]
+
+    tasks = authenticated_client.get("/api/tasks").json()
+    assert [t["id"] for t in tasks] == [third["id"]]
+
+
+@both_session_modes
+def test_task_changes_since_watermark(authenticated_client: TestClient, monkeypatch):
+    """
+    Test that delta sync returns only changes and deletions after the watermark.
+    """
+    import backend.main as main_module
+    monkeypatch.setattr(main_module, "TASK_SYNC_OVERLAP_SECONDS", 0)
+
+    kept = create_task_for_user(authenticated_client, "Kept Task")
+    edited = create_task_for_user(authenticated_client, "Edited Task")
+    removed = create_task_for_user(authenticated_client, "Removed Task")
+
+    response = authenticated_client.get("/api/tasks/changes")
+    assert response.status_code == 200
+    initial = response.json()
+    assert len(initial["changed"]) == 3
+    assert initial["deleted"] == []
+
+    time.sleep(0.01)
+    authenticated_client.put(f"/api/tasks/{edited['id']}", json={"title": "Edited Again"})
+    authenticated_client.delete(f"/api/tasks/{removed['id']}")
+
+    response = authenticated_client.get("/api/tasks/changes", params={"since": initial["watermark"]})
+    assert response.status_code == 200
+    delta = response.json()
+    assert [t["title"] for t in delta["changed"]] == ["Edited Again"]
+    assert delta["deleted"] == [removed["id"]]
+
+    response = authenticated_client.get("/api/tasks/changes", params={"since": "bogus"})
+    assert response.status_code == 400
+
+
+@both_session_modes
+def test_task_changes_initial_sync_is_paged(authenticated_client: TestClient, monkeypatch):
+    """
+    Test that the initial sync is returned in pages, and that changes made
+    while paging are delivered by the first delta poll.
+    """
+    import backend.main as main_module
+    monkeypatch.setattr(main_module, "TASK_SYNC_OVERLAP_SECONDS", 0)
+
+    tasks = [create_task_for_user(authenticated_client, f"Synced {i}") for i in range(5)]
+
+    response = authenticated_client.get("/api/tasks/changes", params={"limit": 2})
+    page = response.json()
+    assert [t["title"] for t in page["changed"]] == ["Synced 0", "Synced 1"]
+    assert page["has_more"] is True
+
+    time.sleep(0.01)
+    authenticated_client.put(f"/api/tasks/{tasks[0]['id']}", json={"title": "Renamed while paging"})
+    authenticated_client.delete(f"/api/tasks/{tasks[1]['id']}")
+
+    titles = [t["title"] for t in page["changed"]]
+    while page["has_more"]:
+        page = authenticated_client.get("/api/tasks/changes", params={"since": page["watermark"], "limit": 2}).json()
+        titles.extend(t["title"] for t in page["changed"])
+    assert titles == [f"Synced {i}" for i in range(5)]
+
+    delta = authenticated_client.get("/api/tasks/changes", params={"since": page["watermark"]}).json()
+    assert [t["title"] for t in delta["changed"]] == ["Renamed while paging"]
+    assert delta["deleted"] == [tasks[1]["id"]]
+    assert delta["has_more"] is False
+
+
+def test_task_changes_retention(authenticated_client: TestClient, test_db_session: Session, monkeypatch):
+    """
+    Test that tombstones older than the retention window are pruned, and that
+    a watermark older than the window asks for a full resync.
+    """
+    from datetime import timedelta
+    import backend.crud as crud_module
+    import backend.main as main_module
+    from backend.models import TaskTombstone
+    from backend.pagination import encode_watermark
+
+    monkeypatch.setattr(main_module, "TASK_SYNC_RETENTION_SECONDS", 3600)
+    monkeypatch.setattr(crud_module, "TASK_SYNC_RETENTION_SECONDS", 3600)
+    user_id = authenticated_client.get("/api/users/me").json()["id"]
+    long_ago = datetime.now(timezone.utc) - timedelta(days=1)
+    test_db_session.add(TaskTombstone(task_id=1, user_id=user_id, deleted_at=long_ago))
+    test_db_session.commit()
+
+    response = authenticated_client.get("/api/tasks/changes", params={"since": encode_watermark(long_ago)})
+    assert response.status_code == 410
+    assert response.json() == {"detail": "Watermark expired; full resync required"}
+
+    since = encode_watermark(datetime.now(timezone.utc) - timedelta(minutes=5))
+    task = create_task_for_user(authenticated_client, "Short-lived")
+    authenticated_client.delete(f"/api/tasks/{task['id']}")
+    assert test_db_session.exec(text("SELECT task_id FROM tasktombstone")).all() == [(task["id"],)]
+    assert authenticated_client.get("/api/tasks/changes", params={"since": since}).json()["deleted"] == [task["id"]]
+
+
+def test_task_etags_and_not_modified(authenticated_client: TestClient):
+    """
+    Test that task reads carry ETags, answer If-None-Match with 304, and
+    change after writes.
+    """
+    task = create_task_for_user(authenticated_client, "Cached Task")
+    assert task["version"] == 1
+
+    response = authenticated_client.get("/api/tasks")
+    list_etag = response.headers["ETag"]
+    response = authenticated_client.get("/api/tasks", headers={"If-None-Match": list_etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+    response = authenticated_client.get(f"/api/tasks/{task['id']}")
+    task_etag = response.headers["ETag"]
+    response = authenticated_client.get(f"/api/tasks/{task['id']}", headers={"If-None-Match": task_etag})
+    assert response.status_code == 304
+
+    updated = authenticated_client.put(f"/api/tasks/{task['id']}", json={"title": "Changed"}).json()
+    assert updated["version"] == 2
+
+    response = authenticated_client.get("/api/tasks", headers={"If-None-Match": list_etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != list_etag
+    response = authenticated_client.get(f"/api/tasks/{task['id']}", headers={"If-None-Match": task_etag})
+    assert response.status_code == 200
+    assert response.json()["title"] == "Changed"
+
+    # A different query on the same collection gets its own ETag
+    response = authenticated_client.get("/api/tasks", params={"status_filter": "completed"})
+    assert response.headers["ETag"] != authenticated_client.get("/api/tasks").headers["ETag"]
+
+
+def test_update_task_if_match(authenticated_client: TestClient):
+    """
+    Test conditional updates with If-Match and with the body's version.
+    """
+    task = create_task_for_user(authenticated_client, "Contended Task")
+    etag = authenticated_client.get(f"/api/tasks/{task['id']}").headers["ETag"]
+
+    # First device wins and gets the new ETag
+    response = authenticated_client.put(
+        f"/api/tasks/{task['id']}", json={"title": "Device A"}, headers={"If-Match": etag}
+    )
+    assert response.status_code == 200
+    assert response.json()["version"] == 2
+    new_etag = response.headers["ETag"]
+
+    # Second device still holds the old ETag: 412 with the current representation
+    response = authenticated_client.put(
+        f"/api/tasks/{task['id']}", json={"title": "Device B"}, headers={"If-Match": etag}
+    )
+    assert response.status_code == 412
+    assert response.json()["title"] == "Device A"
+    assert response.headers["ETag"] == new_etag
+
+    # The version can also be sent in the body
+    response = authenticated_client.put(f"/api/tasks/{task['id']}", json={"title": "Device B", "version": 1})
+    assert response.status_code == 412
+    response = authenticated_client.put(f"/api/tasks/{task['id']}", json={"title": "Device B", "version": 2})
+    assert response.status_code == 200
+    assert response.json()["title"] == "Device B"
+
+    # A missing task is still a 404
+    response = authenticated_client.put("/api/tasks/999999", json={"title": "Nope"}, headers={"If-Match": etag})
+    assert response.status_code == 404
+
+
+def test_fast_json_matches_default_serialization(authenticated_client: TestClient, monkeypatch):
+    """
+    Test that the FAST_JSON path returns the same documents and headers as
+    the response_model path.
+    """
+    import backend.main as main_module
+
+    create_task_for_user(authenticated_client, "Fast Task 1", description="First")
+    create_task_for_user(authenticated_client, "Fast Task 2", status="completed")
+
+    paths = ["/api/users/me", "/api/tasks?limit=1", "/api/tasks/changes"]
+    default = {path: authenticated_client.get(path) for path in paths}
+    monkeypatch.setattr(main_module, "FAST_JSON", True)
+    fast = {path: authenticated_client.get(path) for path in paths}
+
+    for path in paths:
+        assert fast[path].status_code == default[path].status_code == 200
+        assert fast[path].headers["content-type"] == "application/json"
+        if path != "/api/tasks/changes":  # the watermark differs between calls
+            assert fast[path].json() == default[path].json()
+    assert fast["/api/tasks?limit=1"].headers["X-Next-Cursor"] == default["/api/tasks?limit=1"].headers["X-Next-Cursor"]
+    assert fast["/api/tasks?limit=1"].headers["ETag"] == default["/api/tasks?limit=1"].headers["ETag"]
+    assert fast["/api/tasks/changes"].json()["changed"] == default["/api/tasks/changes"].json()["changed"]
+
+    response = authenticated_client.post("/api/tasks", json={"title": "Fast Created"})
+    assert response.status_code == 201
+    assert response.json()["title"] == "Fast Created"
+
+
+@both_session_modes
+def test_export_tasks(authenticated_client: TestClient):
+    """
+    Test streaming a user's tasks as NDJSON and as CSV.
+    """
+    import csv
+    import io
+    import json
+
+    create_task_for_user(authenticated_client, "Export 1", description="with, comma")
+    create_task_for_user(authenticated_client, "Export 2", status="completed")
+
+    response = authenticated_client.get("/api/tasks/export")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [t["title"] for t in lines] == ["Export 1", "Export 2"]
+    assert lines[1]["completed"] == True
+
+    response = authenticated_client.get("/api/tasks/export", params={"format": "csv"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [r["title"] for r in rows] == ["Export 1", "Export 2"]
+    assert rows[0]["description"] == "with, comma"
+
+
+@both_session_modes
+def test_import_tasks(authenticated_client: TestClient, monkeypatch):
+    """
+    Test importing NDJSON and CSV uploads in batches, with rejected rows reported.
+    """
+    import backend.main as main_module
+    monkeypatch.setattr(main_module, "TASK_IMPORT_BATCH_SIZE", 2)
+
+    ndjson = "\n".join([
+        '{"title": "Imported 1"}',
+        '{"title": "Imported 2", "status": "completed"}',
+        "not json",
+        "",
+        '{"title": ""}',
+        '{"title": "Imported 3", "description": "Third"}',
+    ])
+    response = authenticated_client.post(
+        "/api/tasks/import", content=ndjson, headers={"Content-Type": "application/x-ndjson"}
+    )
+    assert response.status_code == 200
+    summary = response.json()
+    assert summary["inserted"] == 3
+    assert summary["rejected"] == 2
+    assert [error["line"] for error in summary["errors"]] == [3, 5]
+
+    csv_body = 'title,description,status\r\nCSV 1,"multi\nline",pending\r\nCSV 2,,completed\r\n,missing title,\r\n'
+    response = authenticated_client.post(
+        "/api/tasks/import", content=csv_body, headers={"Content-Type": "text/csv"}
+    )
+    assert response.status_code == 200
+    assert response.json()["inserted"] == 2
+    assert response.json()["errors"][0]["line"] == 5
+
+    tasks = authenticated_client.get("/api/tasks").json()
+    assert [t["title"] for t in tasks] == ["Imported 1", "Imported 2", "Imported 3", "CSV 1", "CSV 2"]
+    assert tasks[3]["description"] == "multi\nline"
+    assert tasks[4]["completed"] == True
+
+
+def test_import_stamps_each_batch(authenticated_client: TestClient, monkeypatch):
+    """
+    Test that each import batch gets the time it was written, so a delta
+    sync taken between batches still returns the later ones.
+    """
+    import backend.crud as crud_module
+    import backend.main as main_module
+    monkeypatch.setattr(main_module, "TASK_IMPORT_BATCH_SIZE", 1)
+
+    import_tasks = crud_module.import_tasks
+    watermarks = []
+
+    def import_then_sync(db, user_id, rows):
+        inserted = import_tasks(db, user_id, rows)
+        if not watermarks:
+            # A client polls while the import is still running.
+            time.sleep(0.2)
+            watermarks.append(authenticated_client.get("/api/tasks/changes").json()["watermark"])
+        return inserted
+
+    monkeypatch.setattr(crud_module, "import_tasks", import_then_sync)
+    monkeypatch.setattr(main_module, "TASK_SYNC_OVERLAP_SECONDS", 0.1)
+    body = '{"title": "Batch 1"}\n{"title": "Batch 2"}'
+    response = authenticated_client.post(
+        "/api/tasks/import", content=body, headers={"Content-Type": "application/x-ndjson"}
+    )
+    assert response.json()["inserted"] == 2
+
+    changes = authenticated_client.get("/api/tasks/changes", params={"since": watermarks[0]}).json()
+    assert [task["title"] for task in changes["changed"]] == ["Batch 2"]
+
+
+def test_import_rejects_oversized_records(authenticated_client: TestClient, monkeypatch):
+    """
+    Test that import lines and CSV rows over the size limit are rejected as
+    row errors, including a row left open by a stray quote.
+    """
+    import backend.main as main_module
+    monkeypatch.setattr(main_module, "TASK_IMPORT_MAX_RECORD_BYTES", 64)
+
+    ndjson = '{"title": "Short"}\n{"title": "%s"}\n{"title": "After"}\n{"title": "%s"}' % ("x" * 100, "y" * 100)
+    response = authenticated_client.post(
+        "/api/tasks/import", content=ndjson, headers={"Content-Type": "application/x-ndjson"}
+    )
+    summary = response.json()
+    assert (summary["inserted"], summary["rejected"]) == (2, 2)
+    assert [error["line"] for error in summary["errors"]] == [2, 4]
+    assert "longer than 64 bytes" in summary["errors"][0]["errors"][0]["msg"]
+
+    csv_body = 'title\r\nCSV ok\r\n"stray quote\r\n' + "".join(f"row {i}\r\n" for i in range(1000))
+    response = authenticated_client.post(
+        "/api/tasks/import", content=csv_body, headers={"Content-Type": "text/csv"}
+    )
+    summary = response.json()
+    assert (summary["inserted"], summary["rejected"]) == (1, 1)
+    assert summary["errors"][0]["line"] == 3
+    assert "longer than 64 bytes" in summary["errors"][0]["errors"][0]["msg"]
+
+    titles = [t["title"] for t in authenticated_client.get("/api/tasks").json()]
+    assert titles == ["Short", "After", "CSV ok"]
+
+
+def test_timestamps_bind_as_naive_utc():
+    """
+    Test that aware timestamps are bound as naive UTC, as asyncpg requires for
+    TIMESTAMP WITHOUT TIME ZONE columns, and naive ones are left alone.
+    """
+    from datetime import timedelta
+    from sqlalchemy.dialects.postgresql.asyncpg import dialect as asyncpg_dialect
+    from backend.models import UTCDateTime
+
+    column_type = UTCDateTime()
+    local = datetime(2024, 1, 1, 12, 0, tzinfo=timezone(timedelta(hours=2)))
+    assert column_type.process_bind_param(local, asyncpg_dialect()) == datetime(2024, 1, 1, 10, 0)
+    assert column_type.process_bind_param(datetime(2024, 1, 1), asyncpg_dialect()) == datetime(2024, 1, 1)
+    assert column_type.process_bind_param(None, asyncpg_dialect()) is None
+
+
+def test_import_copy_buffer_keeps_null_apart_from_text():
+    """
+    Test the CSV written for PostgreSQL COPY: NULL is an unquoted empty field
+    and every value is quoted, so texts such as \\N or "" are not read as NULL.
+    """
+    from backend.crud import _copy_buffer
+
+    now = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    rows = [
+        {"user_id": "u", "title": r"\N", "description": r"\N", "status": "completed", "completed": True},
+        {"user_id": "u", "title": 'say "hi",\nthen go', "description": None, "status": "pending", "completed": False},
+        {"user_id": "u", "title": "Empty", "description": "", "status": "in_progress", "completed": False},
+    ]
+    for row in rows:
+        row["created_at"] = row["updated_at"] = now
+
+    stamp = '"2024-01-01 00:00:00+00:00"'
+    assert _copy_buffer(rows).getvalue() == (
+        f'"u","\\N","\\N","2","True",{stamp},{stamp}\n'
+        f'"u","say ""hi"",\nthen go",,"0","False",{stamp},{stamp}\n'
+        f'"u","Empty","","1","False",{stamp},{stamp}\n'
+    )
+
+
+def test_response_compression(authenticated_client: TestClient):
+    """
+    Test Accept-Encoding negotiation, the minimum size, and compressed streaming exports.
+    """
+    from backend.compression import negotiate_encoding
+
+    encodings = ("zstd", "br", "gzip")
+    assert negotiate_encoding("gzip, deflate, br, zstd", encodings) == "zstd"
+    assert negotiate_encoding("gzip;q=1.0, br;q=0.5", encodings) == "gzip"
+    assert negotiate_encoding("*;q=0.1, zstd;q=0", encodings) == "br"
+    assert negotiate_encoding("identity", encodings) is None
+    assert negotiate_encoding("", encodings) is None
+
+    for i in range(30):
+        create_task_for_user(authenticated_client, f"Compressed task {i}", description="Same text every time")
+
+    response = authenticated_client.get("/api/tasks", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert int(response.headers["content-length"]) < len(response.content)
+    assert len(response.json()) == 30
+
+    response = authenticated_client.get("/api/tasks", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert len(response.json()) == 30
+
+    # Below the minimum size
+    response = authenticated_client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+
+    response = authenticated_client.get("/api/tasks/export", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    assert len(response.text.splitlines()) == 30
+
+
+def test_task_counts(authenticated_client: TestClient, test_db_session: Session):
+    """
+    Test that every write path keeps the per-status counts behind
+    GET /api/tasks/stats and X-Total-Count, and that reconciliation repairs drift.
+    """
+    from backend.crud import reconcile_task_counts
+
+    def stats():
+        response = authenticated_client.get("/api/tasks/stats")
+        assert response.status_code == 200
+        return response.json()
+
+    assert stats() == {"pending": 0, "in_progress": 0, "completed": 0, "total": 0}
+
+    first = create_task_for_user(authenticated_client, "Counted 1")
+    second = create_task_for_user(authenticated_client, "Counted 2", status="in_progress")
+    authenticated_client.post("/api/tasks/bulk", json=[{"title": "Bulk 1"}, {"title": "Bulk 2", "status": "completed"}])
+    authenticated_client.post(
+        "/api/tasks/import", content='{"title": "Imported", "status": "in_progress"}', headers={"Content-Type": "application/x-ndjson"}
+    )
+    assert stats() == {"pending": 2, "in_progress": 2, "completed": 1, "total": 5}
+
+    authenticated_client.put(f"/api/tasks/{first['id']}", json={"status": "completed"})
+    authenticated_client.put(f"/api/tasks/{first['id']}", json={"status": "completed"})
+    authenticated_client.patch("/api/tasks", json={"status_filter": "in_progress", "status": "pending"})
+    assert stats() == {"pending": 3, "in_progress": 0, "completed": 2, "total": 5}
+
+    authenticated_client.patch("/api/tasks", json={"ids": [first["id"], second["id"]], "status": "in_progress"})
+    authenticated_client.delete(f"/api/tasks/{second['id']}")
+    assert stats() == {"pending": 2, "in_progress": 1, "completed": 1, "total": 4}
+
+    authenticated_client.delete("/api/tasks", params={"status_filter": "pending"})
+    assert stats() == {"pending": 0, "in_progress": 1, "completed": 1, "total": 2}
+
+    response = authenticated_client.get("/api/tasks", params={"limit": 1})
+    assert response.headers["X-Total-Count"] == "2"
+    response = authenticated_client.get("/api/tasks", params={"status_filter": "completed"})
+    assert response.headers["X-Total-Count"] == "1"
+
+    etag = authenticated_client.get("/api/tasks/stats").headers["ETag"]
+    assert authenticated_client.get("/api/tasks/stats", headers={"If-None-Match": etag}).status_code == 304
+
+    user_id = authenticated_client.get("/api/users/me").json()["id"]
+    assert reconcile_task_counts(test_db_session, user_id) is None
+    test_db_session.exec(text("UPDATE user SET pending_count = 7, completed_count = 0"))
+    test_db_session.commit()
+    stored, actual = reconcile_task_counts(test_db_session, user_id)
+    assert stored == {"pending": 7, "in_progress": 1, "completed": 0}
+    assert actual == {"pending": 0, "in_progress": 1, "completed": 1}
+    assert stats() == {"pending": 0, "in_progress": 1, "completed": 1, "total": 2}
+
+    # The repair changes the version, so a client holding the old ETag gets
+    # the repaired counts rather than a 304.
+    response = authenticated_client.get("/api/tasks/stats", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_task_list_cache(authenticated_client: TestClient, monkeypatch):
+    """
+    Test that list responses are served from the cache until a write, and
+    that the memory backend stays within its byte budget.
+    """
+    import asyncio
+    import backend.cache as cache_module
+    from backend.cache import MemoryCache
+
+    task_cache = MemoryCache(max_bytes=1024 * 1024, ttl=60)
+    monkeypatch.setattr(cache_module, "task_lists", task_cache)
+
+    create_task_for_user(authenticated_client, "Cached 1")
+    create_task_for_user(authenticated_client, "Cached 2")
+
+    first = authenticated_client.get("/api/tasks", params={"limit": 1})
+    second = authenticated_client.get("/api/tasks", params={"limit": 1})
+    assert task_cache.stats()["hits"] == 1
+    assert second.content == first.content
+    for header in ("ETag", "X-Total-Count", "X-Next-Cursor", "Link"):
+        assert second.headers[header] == first.headers[header]
+    # Cached bodies match the regular serialization
+    task = second.json()[0]
+    assert task == authenticated_client.get(f"/api/tasks/{task['id']}").json()
+
+    # A write drops the user's entries, and the next list sees it
+    create_task_for_user(authenticated_client, "Cached 3")
+    assert task_cache.stats()["entries"] == 0
+    assert len(authenticated_client.get("/api/tasks").json()) == 3
+    authenticated_client.put(f"/api/tasks/{first.json()[0]['id']}", json={"title": "Renamed"})
+    assert authenticated_client.get("/api/tasks").json()[0]["title"] == "Renamed"
+
+    small = MemoryCache(max_bytes=100, ttl=60)
+    for key in ("a", "b", "c"):
+        asyncio.run(small.set("user", key, b"x" * 40))
+    assert asyncio.run(small.get("user", "a")) is None
+    assert asyncio.run(small.get("user", "c")) == b"x" * 40
+    assert small.stats()["evictions"] == 1
+    assert small.stats()["bytes"] <= 100
+    asyncio.run(small.set("user", "big", b"x" * 200))
+    assert asyncio.run(small.get("user", "big")) is None
+
+
+def test_redis_cache_backend():
+    """
+    Test the Redis-protocol backend against a minimal local stand-in server.
+    """
+    import asyncio
+    import socketserver
+    import threading
+    from backend.cache import RedisCache
+
+    hashes = {}
+
+    class RespHandler(socketserver.StreamRequestHandler):
+        def read_command(self):
+            header = self.rfile.readline()
+            if not header:
+                return None
+            args = []
+            for _ in range(int(header[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2])
+            return args
+
+        def handle(self):
+            while (command := self.read_command()) is not None:
+                name, args = command[0].upper(), command[1:]
+                if name == b"HGET":
+                    value = hashes.get(args[0], {}).get(args[1])
+                    reply = b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+                elif name == b"HSET":
+                    hashes.setdefault(args[0], {})[args[1]] = args[2]
+                    reply = b":1\r\n"
+                elif name == b"DEL":
+                    reply = b":%d\r\n" % (hashes.pop(args[0], None) is not None)
+                elif name == b"EXPIRE":
+                    reply = b":1\r\n"
+                else:
+                    reply = b"-ERR unknown command\r\n"
+                self.wfile.write(reply)
+
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), RespHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        port = server.server_address[1]
+
+        async def exercise():
+            task_cache = RedisCache(f"redis://127.0.0.1:{port}/0", ttl=60)
+            assert await task_cache.get("user", "1?limit=10") is None
+            await task_cache.set("user", "1?limit=10", b'{"a":1}\n[]')
+            assert await task_cache.get("user", "1?limit=10") == b'{"a":1}\n[]'
+            await task_cache.invalidate("user")
+            assert await task_cache.get("user", "1?limit=10") is None
+            return task_cache.stats()
+
+        stats = asyncio.run(exercise())
+        assert (stats["hits"], stats["misses"], stats["errors"]) == (1, 2, 0)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    async def unreachable():
+        task_cache = RedisCache(f"redis://127.0.0.1:{port}/0", ttl=60)
+        assert await task_cache.get("user", "key") is None
+        await task_cache.set("user", "key", b"value")
+        return task_cache.stats()
+
+    assert asyncio.run(unreachable())["errors"] == 2
+
+
+def test_task_fragment_cache(authenticated_client: TestClient, monkeypatch):
+    """
+    Test that list responses reuse encoded tasks and re-encode only changed ones.
+    """
+    import backend.main as main_module
+    from backend.serialization import FragmentCache, task_encoder
+
+    fragments = FragmentCache(task_encoder, ("id", "version", "created_at"), max_bytes=1024 * 1024)
+    monkeypatch.setattr(main_module, "task_fragments", fragments)
+    monkeypatch.setattr(main_module, "FAST_JSON", True)
+
+    tasks = [create_task_for_user(authenticated_client, f"Fragment {i}") for i in range(3)]
+    first = authenticated_client.get("/api/tasks")
+    assert fragments.stats()["misses"] == 3
+    assert authenticated_client.get("/api/tasks").content == first.content
+    assert fragments.stats()["hits"] == 3
+
+    authenticated_client.put(f"/api/tasks/{tasks[1]['id']}", json={"title": "Changed"})
+    listed = authenticated_client.get("/api/tasks").json()
+    assert [t["title"] for t in listed] == ["Fragment 0", "Changed", "Fragment 2"]
+    assert (fragments.stats()["hits"], fragments.stats()["misses"]) == (5, 4)
+
+    # Assembled lists match a full encode, and the byte budget is kept
+    objects = [Task(id=i, user_id="u", title=f"Task {i}", created_at=datetime(2024, 1, 1), updated_at=datetime(2024, 1, 1)) for i in range(50)]
+    small = FragmentCache(task_encoder, ("id", "version", "created_at"), max_bytes=2000)
+    assert small.encode_many(objects) == task_encoder.encode_many(objects)
+    assert small.stats()["bytes"] <= 2000
+    assert small.stats()["evictions"] > 0
+
+
+def test_singleflight_coalesces_concurrent_calls():
+    """
+    Test that concurrent calls with the same key share one execution, for
+    coroutines, plain functions and worker threads, including failures.
+    """
+    import asyncio
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from backend.singleflight import SingleFlight
+
+    flights = SingleFlight()
+    calls = []
+
+    async def slow_read(value):
+        calls.append(value)
+        await asyncio.sleep(0.05)
+        return {"value": value}
+
+    def blocking_read(value):
+        calls.append(value)
+        time.sleep(0.05)
+        return value * 2
+
+    async def failing_read():
+        await asyncio.sleep(0.05)
+        raise ValueError("boom")
+
+    async def exercise():
+        results = await asyncio.gather(*[flights.run("a", slow_read, 1) for _ in range(5)], flights.run("b", slow_read, 2))
+        assert results[:5] == [{"value": 1}] * 5 and results[5] == {"value": 2}
+        assert await asyncio.gather(*[flights.run("c", blocking_read, 3) for _ in range(3)]) == [6, 6, 6]
+        failures = await asyncio.gather(*[flights.run("d", failing_read) for _ in range(3)], return_exceptions=True)
+        assert all(isinstance(failure, ValueError) for failure in failures)
+
+    asyncio.run(exercise())
+    assert calls == [1, 2, 3]
+    assert flights.stats() == {"executions": 4, "coalesced": 8, "in_flight": 0}
+
+    barrier = threading.Barrier(4)
+
+    def in_thread():
+        barrier.wait()
+        return flights.run_sync("e", blocking_read, 4)
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        assert list(pool.map(lambda _: in_thread(), range(4))) == [8, 8, 8, 8]
+    assert calls == [1, 2, 3, 4]
+    assert flights.stats()["coalesced"] == 11
+
+
+def test_request_coalescing(authenticated_client: TestClient, monkeypatch):
+    """
+    Test that identical concurrent requests share one user load, and that
+    coalesced task lists match the regular responses.
+    """
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    import backend.crud as crud_module
+    import backend.main as main_module
+    from backend.singleflight import SingleFlight
+
+    create_task_for_user(authenticated_client, "Coalesced 1")
+    create_task_for_user(authenticated_client, "Coalesced 2")
+    expected = authenticated_client.get("/api/tasks", params={"limit": 1})
+
+    flights = SingleFlight()
+    monkeypatch.setattr(main_module.singleflight, "reads", flights)
+    monkeypatch.setattr(main_module, "REQUEST_COALESCING", True)
+
+    response = authenticated_client.get("/api/tasks", params={"limit": 1})
+    assert response.content == expected.content
+    for header in ("ETag", "X-Total-Count", "X-Next-Cursor", "Link"):
+        assert response.headers[header] == expected.headers[header]
+
+    get_user = crud_module.get_user
+    loads = []
+
+    def slow_get_user(db, user_id):
+        loads.append(user_id)
+        time.sleep(0.3)
+        return get_user(db, user_id)
+
+    monkeypatch.setattr(crud_module, "get_user", slow_get_user)
+    barrier = threading.Barrier(3)
+
+    def read_me(_):
+        barrier.wait()
+        return authenticated_client.get("/api/users/me")
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        responses = list(pool.map(read_me, range(3)))
+    assert [r.status_code for r in responses] == [200, 200, 200]
+    assert len({r.content for r in responses}) == 1
+    assert len(loads) == 1
+    assert flights.stats()["coalesced"] == 2
+
+
+def test_metrics_endpoint(test_db_session: Session, tmp_path, monkeypatch):
+    """
+    Test /metrics: latency by route template and status, in-flight requests,
+    runtime stats, and the sum over worker process snapshots.
+    """
+    import json
+    import backend.cache as cache_module
+    import backend.main as main_module
+    import backend.metrics as metrics_module
+    from backend.cache import MemoryCache
+    from backend.database import get_session
+
+    monkeypatch.setattr(main_module, "METRICS_ENABLED", True)
+    app = main_module.create_app()
+    app.dependency_overrides[get_session] = lambda: test_db_session
+
+    with TestClient(app) as client:
+        token = client.post(
+            "/api/register", json={"email": "metrics@example.com", "password": "metrics-password"}
+        ).json()["access_token"]
+        client.headers["Authorization"] = f"Bearer {token}"
+        task_id = client.post("/api/tasks", json={"title": "Measured"}).json()["id"]
+        assert client.get(f"/api/tasks/{task_id}").status_code == 200
+        assert client.get(f"/api/tasks/{task_id}").status_code == 200
+        assert client.get("/api/nowhere").status_code == 404
+
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        body = response.text
+        assert "# TYPE http_request_duration_seconds histogram" in body
+        assert 'http_request_duration_seconds_count{method="GET",route="/api/tasks/{id}",status="200"} 2' in body
+        assert 'http_request_duration_seconds_bucket{method="GET",route="/api/tasks/{id}",status="200",le="+Inf"} 2' in body
+        assert 'http_request_duration_seconds_count{method="GET",route="<unmatched>",status="404"} 1' in body
+        assert 'http_requests_in_flight{method="GET"} 1' in body  # this scrape
+        assert "password_hash_jobs_total" in body
+        assert 'cache_hit_ratio{cache="verified_tokens"}' in body
+        assert re.search(r'^cache_bytes\{cache="task_fragments"\} \d+$', body, re.M)
+        assert 'cache_max_bytes{cache="task_fragments"}' in body
+        assert 'cache="task_lists"' not in body
+
+        monkeypatch.setattr(cache_module, "task_lists", MemoryCache(max_bytes=1024 * 1024, ttl=60))
+        assert client.get("/api/tasks").status_code == 200
+        body = client.get("/metrics").text
+        list_bytes = re.search(r'^cache_bytes\{cache="task_lists"\} (\d+)$', body, re.M)
+        assert list_bytes and int(list_bytes.group(1)) > 0
+        assert f'cache_max_bytes{{cache="task_lists"}} {1024 * 1024}' in body
+
+        # Another worker's snapshot: its counters are added, and its gauges
+        # are dropped once the process is gone.
+        monkeypatch.setattr(metrics_module, "METRICS_MULTIPROC_DIR", str(tmp_path))
+        exited_pid = 2 ** 22 + 1
+        (tmp_path / f"{exited_pid}.json").write_text(json.dumps({
+            "coalesced_requests_total": {"type": "counter", "help": "h", "samples": [[[], 5]]},
+            "http_requests_in_flight": {"type": "gauge", "help": "h", "samples": [[[["method", "GET"]], 7]]},
+        }))
+        body = client.get("/metrics").text
+        coalesced = metrics_module.REGISTRY.collect()["coalesced_requests_total"]["samples"][()]
+        assert f"coalesced_requests_total {coalesced + 5}" in body
+        assert 'http_requests_in_flight{method="GET"} 1' in body
+        assert (tmp_path / f"{os.getpid()}.json").exists()
+
+
+def test_server_timing_header(test_db_session: Session, monkeypatch):
+    """
+    Test that requests carrying the debug header get a Server-Timing
+    breakdown, and that other requests do not.
+    """
+    import backend.main as main_module
+    from backend.database import get_session
+
+    monkeypatch.setattr(main_module, "SERVER_TIMING_DEBUG_HEADER", "X-Debug-Timing")
+    app = main_module.create_app()
+    app.dependency_overrides[get_session] = lambda: test_db_session
+
+    def phases(response):
+        return {entry.split(";", 1)[0]: entry for entry in response.headers["Server-Timing"].split(", ")}
+
+    with TestClient(app) as client:
+        debug = {"X-Debug-Timing": "1"}
+        response = client.post(
+            "/api/register", json={"email": "timed@example.com", "password": "timed-password"}, headers=debug
+        )
+        assert response.status_code == 201
+        assert {"hash", "hash_queue", "db", "app"} <= set(phases(response))
+        client.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+
+        response = client.post("/api/tasks", json={"title": "Timed"})
+        assert response.status_code == 201
+        assert "Server-Timing" not in response.headers
+
+        response = client.get("/api/tasks", headers=debug)
+        assert response.status_code == 200
+        timings = phases(response)
+        assert {"auth", "user", "db", "serialize", "app"} <= set(timings)
+        assert re.fullmatch(r'db;dur=\d+\.\d{2};desc="\d+ statements?"', timings["db"])
+        assert response.headers["Timing-Allow-Origin"] == "*"
+
+
+def test_request_coalescing_survives_failed_leader(authenticated_client: TestClient, test_engine: Engine, monkeypatch):
+    """
+    Test that a request sharing a coalesced user load still succeeds when the
+    request that ran the load fails and its session is rolled back and closed.
+    """
+    import asyncio
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    import backend.crud as crud_module
+    import backend.main as main_module
+    from backend.database import get_session
+    from backend.singleflight import SingleFlight
+
+    create_task_for_user(authenticated_client, "Follower")
+
+    def session_per_request():
+        with Session(test_engine) as session:
+            yield session
+
+    monkeypatch.setitem(main_module.app.dependency_overrides, get_session, session_per_request)
+    leader_done = threading.Event()
+
+    class LateFollowers(SingleFlight):
+        # Followers resume only after the leader's request has failed and
+        # its session is closed.
+        async def run(self, key, fn, *args, **kwargs):
+            executions = self.executions
+            result = await super().run(key, fn, *args, **kwargs)
+            if self.executions == executions:
+                await asyncio.to_thread(leader_done.wait, 5)
+            return result
+
+    flights = LateFollowers()
+    monkeypatch.setattr(main_module.singleflight, "reads", flights)
+    monkeypatch.setattr(main_module, "REQUEST_COALESCING", True)
+
+    get_user = crud_module.get_user
+    loading = threading.Event()
+
+    def slow_get_user(db, user_id):
+        loading.set()
+        time.sleep(0.3)
+        return get_user(db, user_id)
+
+    monkeypatch.setattr(crud_module, "get_user", slow_get_user)
+
+    def leader():
+        try:
+            return authenticated_client.put("/api/tasks/99999", json={"title": "Missing"})
+        finally:
+            leader_done.set()
+
+    def follower():
+        loading.wait()
+        return authenticated_client.get("/api/tasks")
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        failed, followed = pool.submit(leader), pool.submit(follower)
+        assert failed.result().status_code == 404
+        assert followed.result().status_code == 200
+    assert [task["title"] for task in followed.result().json()] == ["Follower"]
+    assert flights.stats()["coalesced"] == 1
+
+
+def test_metrics_fold_exited_threads():
+    """
+    Test that a metric's per-thread copies are folded into its total when
+    their threads exit, so worker churn does not grow them.
+    """
+    import threading
+    from backend.metrics import Histogram, Registry
+
+    latency = Histogram("churn_seconds", "h", ("route",), buckets=(0.1, 1.0), registry=Registry())
+    latency.observe(0.05, "/")
+    for _ in range(20):
+        thread = threading.Thread(target=latency.observe, args=(0.5, "/"))
+        thread.start()
+        thread.join()
+
+    assert len(latency._shards) == 1  # this thread's
+    assert latency.samples() == {(("route", "/"),): [1, 20, 0, 0.05 + 20 * 0.5]}
+
+
+def test_sql_log_survives_failed_statements(test_engine: Engine, monkeypatch):
+    """
+    Test that statements which raise leave no SQL log state on the pooled
+    connection.
+    """
+    from sqlalchemy import event, exc
+    import backend.query_log as query_log_module
+
+    monkeypatch.setattr(query_log_module, "SQL_LOG_ENABLED", True)
+    monkeypatch.setattr(query_log_module, "SQL_LOG_SAMPLE_RATE", 0)
+    query_log_module.instrument(test_engine)
+    try:
+        with test_engine.connect() as conn:
+            info_before = dict(conn.info)
+            for _ in range(3):
+                with pytest.raises(exc.OperationalError):
+                    conn.execute(text("SELECT * FROM no_such_table"))
+            conn.execute(text("SELECT 1"))
+            assert conn.info == info_before
+    finally:
+        event.remove(test_engine, "before_cursor_execute", query_log_module._before_cursor_execute)
+        event.remove(test_engine, "after_cursor_execute", query_log_module._after_cursor_execute)
+
+
+def test_statement_timing_survives_failed_statements(test_engine: Engine):
+    """
+    Test that statements which raise leave no timing state on the pooled
+    connection, and that later statements are still timed on their own.
+    """
+    from sqlalchemy import exc
+    import backend.timing as timing_module
+
+    timing_module.instrument()
+    timings = timing_module.RequestTimings()
+    token = timing_module._current.set(timings)
+    try:
+        with test_engine.connect() as conn:
+            info_before = dict(conn.info)
+            for _ in range(3):
+                with pytest.raises(exc.OperationalError):
+                    conn.execute(text("SELECT * FROM no_such_table"))
+            conn.execute(text("SELECT 1"))
+            assert conn.info == info_before
+    finally:
+        timing_module._current.reset(token)
+
+    seconds, count = timings.phases["db"]
+    assert count == 1 and 0 <= seconds < 1
+
+
+def test_engine_pool_options_and_registry(monkeypatch):
+    """
+    Test that the DB_POOL_* settings reach create_engine, and that every
+    get_engine call for a URL returns the one registered engine.
+    """
+    import backend.database as database_module
+
+    monkeypatch.setattr(database_module, "_engines", {})
+    monkeypatch.setattr(database_module, "DB_POOL_SIZE", 7)
+    monkeypatch.setattr(database_module, "DB_MAX_OVERFLOW", 3)
+    monkeypatch.setattr(database_module, "DB_POOL_PRE_PING", False)
+    monkeypatch.setattr(database_module, "DB_POOL_RECYCLE", 60)
+    monkeypatch.setattr(database_module, "DB_POOL_TIMEOUT", 4)
+
+    calls = []
+    real_create_engine = database_module.create_engine
+
+    def recording_create_engine(url, **options):
+        calls.append((url, options))
+        return real_create_engine(url, **options)
+
+    monkeypatch.setattr(database_module, "create_engine", recording_create_engine)
+
+    url = "postgresql://user@localhost/pool_test"  # never connected to
+    engine = database_module.get_engine(url)
+    try:
+        assert database_module.get_engine(url) is engine
+        assert len(calls) == 1
+        options = calls[0][1]
+        assert {key: options[key] for key in ("pool_size", "max_overflow", "pool_pre_ping", "pool_recycle", "pool_timeout")} == {
+            "pool_size": 7, "max_overflow": 3, "pool_pre_ping": False, "pool_recycle": 60, "pool_timeout": 4,
+        }
+        assert engine.pool.size() == 7
+        assert engine.pool.timeout() == 4
+
+        sqlite_engine = database_module.get_engine("sqlite://")
+        assert database_module.get_engine("sqlite://") is sqlite_engine is not engine
+        assert calls[1][1] == {"connect_args": {"check_same_thread": False}}
+    finally:
+        database_module.dispose_engines()
+
+
+def test_sql_log_fingerprints():
+    """
+    Test that statements differing only in literals, parameter style or the
+    length of IN / VALUES lists share a fingerprint.
+    """
+    from backend.query_log import fingerprint
+
+    by_id = fingerprint("SELECT * FROM task WHERE id = 5 AND title = 'it''s'")
+    assert by_id == fingerprint("SELECT * FROM task WHERE id = 17 AND title = 'other'")
+    assert by_id[1] == "SELECT * FROM task WHERE id = ? AND title = ?"
+
+    in_list = fingerprint("SELECT * FROM task WHERE id IN (?, ?, ?)")
+    assert in_list == fingerprint("SELECT * FROM task\n WHERE id IN (%(id_1)s, %(id_2)s)")
+    assert in_list == fingerprint("SELECT * FROM task WHERE id IN ($1)")
+    assert in_list[1] == "SELECT * FROM task WHERE id IN (?)"
+
+    values = fingerprint("INSERT INTO task (title, status) VALUES (?, ?), (?, ?), (?, ?)")
+    assert values == fingerprint("INSERT INTO task (title, status) VALUES (:title, :status)")
+    assert values != fingerprint("INSERT INTO tasktombstone (title, status) VALUES (?, ?)")
+
+
+def test_sql_log_sampling(test_engine: Engine, monkeypatch):
+    """
+    Test that statements slower than SQL_LOG_SLOW_MS are always logged, and
+    that with a sample rate of 0 faster ones are not logged at all.
+    """
+    import logging
+    from sqlalchemy import event
+    import backend.query_log as query_log_module
+
+    records = []
+
+    class Capture(logging.Handler):
+        def emit(self, record):
+            records.append(record)
+
+    handler = Capture()
+    query_log_module.logger.addHandler(handler)
+    monkeypatch.setattr(query_log_module.logger, "level", logging.INFO)
+    monkeypatch.setattr(query_log_module, "SQL_LOG_ENABLED", True)
+    monkeypatch.setattr(query_log_module, "SQL_LOG_SAMPLE_RATE", 0)
+    query_log_module.instrument(test_engine)
+    try:
+        monkeypatch.setattr(query_log_module, "SQL_LOG_SLOW_MS", 60_000)
+        with test_engine.connect() as conn:
+            for _ in range(20):
+                conn.execute(text("SELECT 1"))
+        assert records == []
+
+        monkeypatch.setattr(query_log_module, "SQL_LOG_SLOW_MS", 0)
+        with test_engine.connect() as conn:
+            conn.execute(text("SELECT 42"))
+        assert len(records) == 1
+        assert records[0].levelno == logging.WARNING
+        assert records[0].sql["slow"] is True
+        assert records[0].sql["statement"] == "SELECT ?"
+    finally:
+        query_log_module.logger.removeHandler(handler)
+        event.remove(test_engine, "before_cursor_execute", query_log_module._before_cursor_execute)
+        event.remove(test_engine, "after_cursor_execute", query_log_module._after_cursor_execute)
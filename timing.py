@@ -0,0 +1,205 @@
+"""
+Server-Timing response header.
+
+A sampled request (or one carrying the debug header) gets a per-request
+``RequestTimings`` in a context variable. Code on the request path adds to it
+through ``phase`` / ``record``. The context is copied into threadpool calls and
+the async session's greenlets, so the phases also cover work done there. The
+header lists each phase's total duration in milliseconds, for example::
+
+    Server-Timing: auth;dur=0.21, user;dur=1.9, db;dur=3.4;desc="3 statements", serialize;dur=0.6, app;dur=7.8
+
+Phases overlap: ``db`` sums every statement, including those run while loading
+the user, and ``app`` is the whole time until the response headers were sent.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Set
+import asyncio
+import functools
+import random
+import time
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+class RequestTimings:
+    def __init__(self):
+        self.phases: Dict[str, List[float]] = {}  # name -> [seconds, count]
+        self.open: Set[str] = set()
+        self.endpoint_finished: Optional[float] = None
+
+    def add(self, name: str, seconds: float) -> None:
+        entry = self.phases.get(name)
+        if entry is None:
+            self.phases[name] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+    def header(self, total: float) -> str:
+        entries = []
+        for name, (seconds, count) in self.phases.items():
+            entry = f"{name};dur={seconds * 1000:.2f}"
+            if name == "db":
+                entry += f';desc="{count} statement{"" if count == 1 else "s"}"'
+            entries.append(entry)
+        entries.append(f"app;dur={total * 1000:.2f}")
+        return ", ".join(entries)
+
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar("server_timing", default=None)
+
+
+@contextmanager
+def phase(name: str):
+    """
+    Adds the time spent in the block to phase ``name`` of the current request.
+    A block nested in an open phase of the same name is not counted twice.
+    """
+    timings = _current.get()
+    if timings is None or name in timings.open:
+        yield
+        return
+    timings.open.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.open.discard(name)
+        timings.add(name, time.perf_counter() - started)
+
+
+def record(name: str, seconds: float) -> None:
+    """
+    Adds an already measured duration to phase ``name`` of the current request.
+    """
+    timings = _current.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+# --- Database statements ---
+
+# The start time is kept on the statement's execution context, which is
+# discarded with it: a statement that raises never reaches after_cursor_execute,
+# and must not leave anything behind on the pooled connection.
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        context._server_timing_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = _current.get()
+    started = getattr(context, "_server_timing_start", None)
+    if timings is not None and started is not None:
+        timings.add("db", time.perf_counter() - started)
+
+
+_instrumented = False
+
+
+def instrument() -> None:
+    """
+    Times the statements of every engine, sync or async, for the ``db`` phase.
+    Statements of requests that are not timed only pay for a context variable
+    lookup.
+    """
+    global _instrumented
+    if _instrumented:
+        return
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    _instrumented = True
+
+
+# --- Response validation and serialization ---
+
+class TimedRoute(APIRoute):
+    """
+    APIRoute that adds the work FastAPI does after the endpoint returns
+    (response_model validation and JSON encoding) to the ``serialize`` phase.
+    """
+
+    def get_route_handler(self) -> Callable:
+        endpoint = self.dependant.call
+
+        def finished() -> None:
+            timings = _current.get()
+            if timings is not None:
+                timings.endpoint_finished = time.perf_counter()
+
+        if asyncio.iscoroutinefunction(endpoint):
+            @functools.wraps(endpoint)
+            async def call(*args, **kwargs):
+                try:
+                    return await endpoint(*args, **kwargs)
+                finally:
+                    finished()
+        else:
+            @functools.wraps(endpoint)
+            def call(*args, **kwargs):
+                try:
+                    return endpoint(*args, **kwargs)
+                finally:
+                    finished()
+
+        self.dependant.call = call
+        handler = super().get_route_handler()
+
+        async def timed_handler(request):
+            response = await handler(request)
+            timings = _current.get()
+            if timings is not None and timings.endpoint_finished is not None:
+                timings.add("serialize", time.perf_counter() - timings.endpoint_finished)
+                timings.endpoint_finished = None
+            return response
+
+        return timed_handler
+
+
+# --- Middleware ---
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware that times a ``sample_rate`` fraction of requests, and
+    every request carrying ``debug_header``, and adds the Server-Timing header
+    to their responses.
+    """
+
+    def __init__(self, app: ASGIApp, sample_rate: float = 0.0, debug_header: str = ""):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.debug_header = debug_header.lower()
+
+    def sampled(self, scope: Scope) -> bool:
+        if self.debug_header and self.debug_header in Headers(scope=scope):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self.sampled(scope):
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        started = time.perf_counter()
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", timings.header(time.perf_counter() - started))
+                # Lets cross-origin pages read the header (the API allows any origin).
+                headers.append("Timing-Allow-Origin", "*")
+            await send(message)
+
+        token = _current.set(timings)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)